@@ -4,16 +4,26 @@ from django.contrib import admin
 from django.contrib.contenttypes.models import ContentType
 from django.urls import reverse
 from django.http import HttpResponseRedirect
+from django.utils.http import urlencode
 from django.utils.translation import gettext_lazy as _
 from django.core.serializers.json import DjangoJSONEncoder
 from .config import get_config
 
 
 def export_selected_objects(modeladmin, request, queryset):
-    selected = list(queryset.values_list('id', flat=True))
     ct = ContentType.objects.get_for_model(queryset.model)
     url = reverse("admin_export_action:export")
 
+    if get_config('EXPORT_BY_FILTERS') and request.POST.get('select_across') == '1':
+        # all the changelist objects are selected: send the changelist
+        # filters, the export view rebuilds the queryset from them
+        return HttpResponseRedirect("%s?%s" % (url, urlencode({
+            'ct': ct.pk,
+            'changelist_filters': request.GET.urlencode(),
+        })))
+
+    selected = list(queryset.values_list('id', flat=True))
+
     if len(selected) > 1000:
         session_key = "export_action_%s" % uuid.uuid4()
         request.session[session_key] =  json.dumps(selected, cls=DjangoJSONEncoder)
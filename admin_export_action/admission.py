@@ -0,0 +1,181 @@
+# coding: utf-8
+"""Admission control of exports.
+
+Every synchronous export takes a slot before it starts and gives it back
+when its response is closed, that is when a streamed response has been
+sent. Slots are limited per process (ADMISSION_MAX_EXPORTS), per user
+(ADMISSION_MAX_USER_EXPORTS) and, through a Django cache shared by all
+the processes, per site (ADMISSION_MAX_SHARED_EXPORTS). Exports of more
+than ADMISSION_SLOW_LANE_ROWS rows also take a slot of the slow lane,
+limited to ADMISSION_MAX_SLOW_EXPORTS, so that big exports cannot take
+all the slots. An export waits for a slot up to ADMISSION_TIMEOUT
+seconds, then it is rejected.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import threading
+import time
+
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.translation import gettext as _
+
+from .config import get_config
+
+SHARED_KEY = "admin_export_action:running_exports"
+# a process killed while exporting never releases its shared slot, the
+# counter expires after this many seconds without exports starting
+SHARED_KEY_TIMEOUT = 60 * 60
+# the shared counter is not notified of releases, it is polled
+SHARED_POLL_INTERVAL = 0.5
+
+_condition = threading.Condition()
+_running = {"total": 0, "slow": 0, "users": {}}
+
+
+def _is_set(key):
+    return get_config(key) is not None
+
+
+def _has_room(user_pk, slow):
+    """Whether the process and user limits leave room for an export,
+    called with _condition held"""
+    limits = (
+        ("ADMISSION_MAX_EXPORTS", _running["total"]),
+        ("ADMISSION_MAX_USER_EXPORTS", _running["users"].get(user_pk, 0)),
+        ("ADMISSION_MAX_SLOW_EXPORTS", _running["slow"] if slow else 0),
+    )
+    return all(
+        running < get_config(key) for key, running in limits if _is_set(key)
+    )
+
+
+def _acquire_shared():
+    limit = get_config("ADMISSION_MAX_SHARED_EXPORTS")
+    if limit is None:
+        return True
+    cache = caches[get_config("ADMISSION_CACHE_ALIAS")]
+    cache.add(SHARED_KEY, 0, SHARED_KEY_TIMEOUT)
+    try:
+        running = cache.incr(SHARED_KEY)
+    except ValueError:  # expired in the meantime
+        cache.add(SHARED_KEY, 1, SHARED_KEY_TIMEOUT)
+        return True
+    if running > limit:
+        _release_shared()
+        return False
+    cache.touch(SHARED_KEY, SHARED_KEY_TIMEOUT)
+    return True
+
+
+def _release_shared():
+    if get_config("ADMISSION_MAX_SHARED_EXPORTS") is None:
+        return
+    try:
+        caches[get_config("ADMISSION_CACHE_ALIAS")].decr(SHARED_KEY)
+    except ValueError:
+        pass
+
+
+def is_slow(queryset):
+    """Whether the export of queryset goes to the slow lane"""
+    threshold = get_config("ADMISSION_SLOW_LANE_ROWS")
+    return threshold is not None and queryset.count() > threshold
+
+
+class Slot(object):
+    """A running export, release it once the export is finished"""
+
+    def __init__(self, user_pk, slow):
+        self.user_pk = user_pk
+        self.slow = slow
+        self.released = False
+
+    def release(self):
+        with _condition:
+            if self.released:
+                return
+            self.released = True
+            _running["total"] -= 1
+            if self.slow:
+                _running["slow"] -= 1
+            _running["users"][self.user_pk] -= 1
+            if not _running["users"][self.user_pk]:
+                del _running["users"][self.user_pk]
+            _release_shared()
+            _condition.notify_all()
+
+
+def acquire(user, queryset):
+    """Take a slot for an export of queryset by user, waiting up to
+    ADMISSION_TIMEOUT seconds. Return the Slot, None if every slot is
+    still taken."""
+    slow = is_slow(queryset)
+    deadline = time.monotonic() + (get_config("ADMISSION_TIMEOUT") or 0)
+    with _condition:
+        while True:
+            if _has_room(user.pk, slow) and _acquire_shared():
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            if _is_set("ADMISSION_MAX_SHARED_EXPORTS"):
+                remaining = min(remaining, SHARED_POLL_INTERVAL)
+            _condition.wait(remaining)
+        _running["total"] += 1
+        if slow:
+            _running["slow"] += 1
+        _running["users"][user.pk] = _running["users"].get(user.pk, 0) + 1
+    return Slot(user.pk, slow)
+
+
+class _ReleasingContent(object):
+    """Streaming content releasing slot once exhausted or closed.
+    Django closes the streaming content when the response is closed,
+    even if it was never iterated (the client has gone, an exception
+    was raised by a middleware...), which a generator could not handle:
+    its finally clause only runs if it was started."""
+
+    def __init__(self, content, slot):
+        self.content = iter(content)
+        self.slot = slot
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.content)
+        except StopIteration:
+            self.slot.release()
+            raise
+
+    def close(self):
+        try:
+            if hasattr(self.content, "close"):
+                self.content.close()
+        finally:
+            self.slot.release()
+
+
+def release_on_close(response, slot):
+    """Release slot right away for a response whose content is built
+    already, once the whole content has been sent, or the response is
+    closed, for a streaming response"""
+    if response.streaming:
+        response.streaming_content = _ReleasingContent(
+            response.streaming_content, slot)
+    else:
+        slot.release()
+    return response
+
+
+def too_many_exports_response():
+    response = HttpResponse(
+        _("Too many exports are running, please retry later."),
+        content_type="text/plain; charset=UTF-8",
+        status=429,
+    )
+    response["Retry-After"] = get_config("ADMISSION_RETRY_AFTER")
+    return response
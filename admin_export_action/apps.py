@@ -0,0 +1,18 @@
+# coding: utf-8
+from django.apps import AppConfig
+from django.utils.translation import gettext_lazy as _
+
+from .config import get_config
+
+
+class AdminExportActionConfig(AppConfig):
+    name = 'admin_export_action'
+    verbose_name = _('Admin export action')
+
+    def ready(self):
+        if get_config('WARM_INTROSPECTION_CACHE'):
+            from .introspection import warm_model_fields_cache
+            warm_model_fields_cache()
+        if get_config('RESULT_CACHE') and get_config('RESULT_CACHE_INVALIDATE'):
+            from .result_cache import connect_signals
+            connect_signals()
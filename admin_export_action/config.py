@@ -5,6 +5,41 @@ default_config = {
     'ADMIN_SITE_PATH': None,
     'ENABLE_SITEWIDE': True,
     'VALUE_TO_XLSX_CELL': None,
+    'STREAMING': False,
+    'CHUNK_SIZE': 2000,
+    'HTML_PAGE_SIZE': 100,
+    'EXPORT_BY_FILTERS': True,
+    'PK_IN_THRESHOLD': 1000,
+    'ASYNC_EXPORT': None,
+    'ASYNC_WORKERS': 2,
+    'ASYNC_STORAGE': None,
+    'ASYNC_RETENTION': 24 * 60 * 60,
+    'ASYNC_TIMEOUT': 6 * 60 * 60,
+    'RESULT_CACHE': False,
+    'RESULT_CACHE_ALIAS': 'default',
+    'RESULT_CACHE_TIMEOUT': 300,
+    'RESULT_CACHE_MAX_SIZE': 50 * 1024 * 1024,
+    'RESULT_CACHE_INVALIDATE': True,
+    # bookkeeping models, saved on every request, login or export
+    'RESULT_CACHE_IGNORE_MODELS': (
+        'sessions.Session',
+        'admin.LogEntry',
+        'admin_export_action.ExportJob',
+    ),
+    'WARM_INTROSPECTION_CACHE': False,
+    'TO_MANY_SEPARATOR': ', ',
+    'SHEET_WORKERS': 4,
+    'XLSX_BACKEND': 'openpyxl',
+    'XLSX_MAX_ROWS': 1048576,
+    'POSTGRES_COPY': False,
+    'ADMISSION_MAX_EXPORTS': None,
+    'ADMISSION_MAX_USER_EXPORTS': None,
+    'ADMISSION_MAX_SHARED_EXPORTS': None,
+    'ADMISSION_CACHE_ALIAS': 'default',
+    'ADMISSION_SLOW_LANE_ROWS': None,
+    'ADMISSION_MAX_SLOW_EXPORTS': 1,
+    'ADMISSION_TIMEOUT': 0,
+    'ADMISSION_RETRY_AFTER': 30,
 }
 
 
@@ -0,0 +1,168 @@
+# coding: utf-8
+"""Timing of the export phases.
+
+An ExportTimings collects the time spent in every phase of an export
+(sql, convert, write, save) and counts the exported rows, columns and
+bytes. While it is active in the current thread, the report functions
+record into it; phases nest, the time spent in an inner phase is not
+counted in the outer one. When the export is finished the timings are
+logged and the export_finished signal is sent.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from .signals import export_finished
+
+logger = logging.getLogger(__name__)
+
+PHASES = ("sql", "convert", "write", "save")
+
+_local = threading.local()
+
+
+def get_current():
+    """Return the timings active in the current thread, None if any"""
+    return getattr(_local, "timings", None)
+
+
+@contextmanager
+def phase(name):
+    """Account the time spent in the block to the `name` phase of the
+    active timings"""
+    timings = get_current()
+    if timings is None:
+        yield
+        return
+    timings.start(name)
+    try:
+        yield
+    finally:
+        timings.stop()
+
+
+def add_rows(count):
+    timings = get_current()
+    if timings is not None:
+        timings.rows += count
+
+
+def set_columns(count):
+    timings = get_current()
+    if timings is not None:
+        timings.columns = count
+
+
+class ExportTimings(object):
+
+    def __init__(self, model=None, format=None, user=None):
+        self.model = model
+        self.format = format
+        self.user = user
+        self.durations = OrderedDict((name, 0.0) for name in PHASES)
+        self.rows = 0
+        self.columns = 0
+        self.bytes = 0
+        self.total = None
+        self._started = time.perf_counter()
+        self._stack = []
+
+    def start(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            outer, since = self._stack[-1]
+            self.durations[outer] = self.durations.get(outer, 0.0) + now - since
+        self._stack.append([name, now])
+
+    def stop(self):
+        now = time.perf_counter()
+        name, since = self._stack.pop()
+        self.durations[name] = self.durations.get(name, 0.0) + now - since
+        if self._stack:
+            self._stack[-1][1] = now
+
+    @contextmanager
+    def activate(self):
+        previous = get_current()
+        _local.timings = self
+        try:
+            yield self
+        finally:
+            _local.timings = previous
+
+    def server_timing(self):
+        """Value of the Server-Timing header, durations in milliseconds"""
+        total = self.total
+        if total is None:
+            total = time.perf_counter() - self._started
+        metrics = [(name, duration) for name, duration in self.durations.items()
+                   if duration]
+        metrics.append(("total", total))
+        return ", ".join("%s;dur=%.1f" % (name, duration * 1000)
+                         for name, duration in metrics)
+
+    def as_dict(self):
+        return {
+            "model": self.model._meta.label if self.model else None,
+            "format": self.format,
+            "user": getattr(self.user, "pk", None),
+            "durations": dict(self.durations),
+            "total": self.total,
+            "rows": self.rows,
+            "columns": self.columns,
+            "bytes": self.bytes,
+        }
+
+    def finish(self):
+        """Log the timings and send the export_finished signal, once"""
+        if self.total is not None:
+            return
+        self.total = time.perf_counter() - self._started
+        logger.info(
+            "Exported %d rows, %d columns, %d bytes of %s as %s in %.3fs (%s)",
+            self.rows,
+            self.columns,
+            self.bytes,
+            self.model._meta.label if self.model else None,
+            self.format,
+            self.total,
+            ", ".join("%s %.3fs" % item for item in self.durations.items()),
+            extra={"export_timings": self.as_dict()},
+        )
+        export_finished.send(sender=self.model, timings=self)
+
+
+def instrument_response(response, timings):
+    """Add the Server-Timing header to response and finish timings once
+    the response content has been generated.
+    Streaming responses are finished when the stream is exhausted, their
+    header only includes what was timed before the response was returned.
+    """
+    response["Server-Timing"] = timings.server_timing()
+    if not response.streaming:
+        timings.bytes = len(response.content)
+        timings.finish()
+        return response
+
+    streaming_content = response.streaming_content
+
+    def content():
+        chunks = iter(streaming_content)
+        try:
+            while True:
+                with timings.activate(), phase("write"):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                timings.bytes += len(chunk)
+                yield chunk
+        finally:
+            timings.finish()
+
+    response.streaming_content = content()
+    return response
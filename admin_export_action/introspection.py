@@ -2,9 +2,12 @@
 
 from __future__ import unicode_literals, absolute_import
 
+from collections import namedtuple
 from itertools import chain
 
+from django.apps import apps
 from django.contrib.contenttypes.models import ContentType
+from django.utils.translation import get_language
 try:
     from django.db.models.fields import FieldDoesNotExist
 except:
@@ -50,31 +53,80 @@ def _get_all_field_names(model):
     )))
 
 
-def get_relation_fields_from_model(model_class):
-    """ Get related fields (m2m, FK, and reverse FK) """
+FieldInfo = namedtuple("FieldInfo", "name field_name verbose_name accessor_name label field")
+ModelFields = namedtuple("ModelFields", "direct relations")
+
+_model_fields_cache = {}
+
+
+def _get_field_info(field, field_name):
+    verbose_name = getattr(field, 'verbose_name', None)
+    accessor_name = None
+    if hasattr(field, 'get_accessor_name'):
+        accessor_name = field.get_accessor_name()
+    return FieldInfo(
+        name=field.name,
+        field_name=field_name,
+        verbose_name=verbose_name,
+        accessor_name=accessor_name,
+        label=verbose_name or accessor_name or field.name,
+        field=field,
+    )
+
+
+def _build_model_fields(model_class):
+    direct_fields = []
     relation_fields = []
     all_fields_names = _get_all_field_names(model_class)
     for field_name in all_fields_names:
         field, model, direct, m2m = _get_field_by_name(model_class, field_name)
-        # get_all_field_names will return the same field
-        # both with and without _id. Ignore the duplicate.
-        if field_name[-3:] == '_id' and field_name[:-3] in all_fields_names:
-            continue
         if m2m or not direct or _get_remote_field(field):
-            field.field_name_override = field_name
-            relation_fields += [field]
+            # get_all_field_names will return the same field
+            # both with and without _id. Ignore the duplicate.
+            if field_name[-3:] == '_id' and field_name[:-3] in all_fields_names:
+                continue
+            relation_fields.append(_get_field_info(field, field_name))
+        else:
+            direct_fields.append(_get_field_info(field, field_name))
+
+    return ModelFields(
+        direct=tuple(sorted(direct_fields, key=lambda f: str(f.label))),
+        relations=tuple(sorted(relation_fields, key=lambda f: str(f.label))),
+    )
+
+
+def get_model_fields(model_class):
+    """ Return the direct and relation fields of a model, as sorted tuples
+    of FieldInfo. Results are cached per model and language (labels are
+    sorted once translated). """
+    key = (model_class, get_language())
+    try:
+        return _model_fields_cache[key]
+    except KeyError:
+        model_fields = _model_fields_cache[key] = _build_model_fields(
+            model_class)
+        return model_fields
+
+
+def warm_model_fields_cache():
+    """ Fill the introspection cache for every installed model """
+    for model_class in apps.get_models():
+        get_model_fields(model_class)
+
+
+def get_relation_fields_from_model(model_class):
+    """ Get related fields (m2m, FK, and reverse FK), as Django fields,
+    see get_model_fields for the cached descriptors """
+    relation_fields = []
+    for info in get_model_fields(model_class).relations:
+        info.field.field_name_override = info.field_name
+        relation_fields.append(info.field)
     return relation_fields
 
 
 def get_direct_fields_from_model(model_class):
-    """ Direct, not m2m, not FK """
-    direct_fields = []
-    all_fields_names = _get_all_field_names(model_class)
-    for field_name in all_fields_names:
-        field, model, direct, m2m = _get_field_by_name(model_class, field_name)
-        if direct and not m2m and not _get_remote_field(field):
-            direct_fields += [field]
-    return direct_fields
+    """ Direct, not m2m, not FK, as Django fields """
+    return [info.field for info in get_model_fields(model_class).direct]
 
 
 def get_model_from_path_string(root_model, path):
@@ -115,7 +167,7 @@ def get_fields(model_class, field_name='', path=''):
         path: Our new path
     :rtype: dict
     """
-    fields = get_direct_fields_from_model(model_class)
+    fields = get_model_fields(model_class).direct
     app_label = model_class._meta.app_label
 
     if field_name != '':
@@ -131,7 +183,7 @@ def get_fields(model_class, field_name='', path=''):
         else:  # Indirect related field
             new_model = field.related_model
 
-        fields = get_direct_fields_from_model(new_model)
+        fields = get_model_fields(new_model).direct
 
         app_label = new_model._meta.app_label
 
@@ -164,7 +216,7 @@ def get_related_fields(model_class, field_name, path=""):
     else:
         new_model = model_class
 
-    new_fields = get_relation_fields_from_model(new_model)
+    new_fields = get_model_fields(new_model).relations
     model_ct = ContentType.objects.get_for_model(new_model)
 
     return (new_fields, model_ct, path)
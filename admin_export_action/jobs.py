@@ -0,0 +1,215 @@
+# coding: utf-8
+"""Background exports.
+
+Exports are stored as ExportJob records and run either in a local
+thread pool (ASYNC_EXPORT = 'thread') or by the process_export_jobs
+management command polling the database (ASYNC_EXPORT = 'command'),
+so no external broker is needed.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from tempfile import TemporaryFile
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.files import File
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import instrumentation, report, selection
+from .config import get_config
+from .models import ExportJob
+
+logger = logging.getLogger(__name__)
+
+WRITERS = {
+    'csv': (report.iter_to_csv_response, '.csv'),
+    'json': (report.iter_to_json_response, '.json'),
+    'ndjson': (report.iter_to_ndjson_response, '.ndjson'),
+    'html': (report.iter_to_html_response, '.html'),
+    'xlsx': (report.iter_to_xlsx_response, '.xlsx'),
+}
+ARROW_WRITERS = {
+    'parquet': (report.arrow_to_parquet_response, '.parquet'),
+    'arrow': (report.arrow_to_ipc_response, '.arrow'),
+}
+# one sheet for the parent model and one per to-many relation
+SHEETS_FORMAT = 'sheets'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=get_config('ASYNC_WORKERS'),
+                thread_name_prefix='admin_export_action',
+            )
+    return _executor
+
+
+def create_export_job(model_class, export_selection, fields, user,
+                      raw_choices=False, format='xlsx', include_header=True,
+                      aggregate_many=False):
+    """ Store an export job of the objects of model_class in
+    export_selection, see selection.py, and, in thread mode, schedule it
+    once the current transaction is committed """
+    job = ExportJob.objects.create(
+        user=user,
+        content_type=ContentType.objects.get_for_model(model_class),
+        selection=export_selection,
+        fields=list(fields),
+        format=format if format in WRITERS or format == SHEETS_FORMAT or (
+            format in ARROW_WRITERS and report.pyarrow is not None) else 'xlsx',
+        raw_choices=raw_choices,
+        aggregate_many=aggregate_many,
+        include_header=include_header,
+    )
+    if get_config('ASYNC_EXPORT') == 'thread':
+        cleanup_export_jobs()
+        transaction.on_commit(
+            lambda: get_executor().submit(_run_in_thread, job.pk))
+    return job
+
+
+def _run_in_thread(pk):
+    try:
+        run_export_job(ExportJob.objects.get(pk=pk))
+    finally:
+        # worker threads own their database connections
+        connections.close_all()
+
+
+def run_export_job(job):
+    """ Run a pending job, saving the exported file in the job record.
+    Returns False if the job was already taken by another worker. """
+    started_on = timezone.now()
+    claimed = ExportJob.objects.filter(
+        pk=job.pk, status=ExportJob.STATUS_PENDING).update(
+            status=ExportJob.STATUS_RUNNING, started_on=started_on)
+    if not claimed:
+        return False
+    job.status = ExportJob.STATUS_RUNNING
+    job.started_on = started_on
+
+    timings = instrumentation.ExportTimings(format=job.format, user=job.user)
+    try:
+        with timings.activate(), instrumentation.phase('write'):
+            job.message = _write_export_file(job, timings)
+        job.status = ExportJob.STATUS_DONE
+    except Exception as e:
+        logger.exception('Export job %s failed', job.pk)
+        job.status = ExportJob.STATUS_FAILED
+        job.message = str(e)
+
+    job.finished_on = timezone.now()
+    job.save()
+    if job.status == ExportJob.STATUS_DONE:
+        timings.finish()
+    return True
+
+
+def _write_export_file(job, timings):
+    """ Export the data of job to job.file, returns the report message """
+    model_class = ContentType.objects.get_for_id(
+        job.content_type_id).model_class()
+    timings.model = model_class
+    # rebuilt as the user sees it now, through the admin of the model
+    queryset = selection.get_queryset(selection.get_user_request(job.user),
+                                      model_class, job.selection)
+
+    header = [
+        report.get_field_verbose_name(queryset, field)
+        for field in job.fields
+    ] if job.include_header else None
+
+    if job.format == 'csv' and get_config('POSTGRES_COPY'):
+        chunks, message = report.report_to_copy_csv(
+            queryset,
+            job.fields,
+            job.user,
+            raw_choices=job.raw_choices,
+            aggregate_many=job.aggregate_many,
+            header=header)
+        extension = '.csv'
+        response = report.csv_chunks_to_response(chunks)
+    elif job.format == SHEETS_FORMAT:
+        sheets, headers, message = report.report_to_sheets(
+            queryset,
+            job.fields,
+            job.user,
+            raw_choices=job.raw_choices)
+        extension = '.xlsx'
+        response = report.list_to_xlsx_response(
+            sheets, header=headers if job.include_header else None)
+    elif job.format in ARROW_WRITERS:
+        schema, batches, message = report.report_to_arrow(
+            queryset,
+            job.fields,
+            job.user,
+            raw_choices=job.raw_choices,
+            aggregate_many=job.aggregate_many,
+            verbose_names=job.include_header)
+        writer, extension = ARROW_WRITERS[job.format]
+        response = writer(schema, batches)
+    else:
+        rows, message = report.report_to_iterator(
+            queryset,
+            job.fields,
+            job.user,
+            raw_choices=job.raw_choices,
+            aggregate_many=job.aggregate_many)
+        writer, extension = WRITERS[job.format]
+        response = writer(rows, header=header)
+    with TemporaryFile() as tmp:
+        for chunk in response:
+            tmp.write(chunk)
+            timings.bytes += len(chunk)
+        report.close_response(response)
+        tmp.seek(0)
+        # named after job.pk by ExportJob.file upload_to
+        job.file.save('report' + extension, File(tmp), save=False)
+    return message
+
+
+def cleanup_export_jobs():
+    """ Fail the jobs pending or running since more than ASYNC_TIMEOUT
+    seconds, their process is gone, and delete the jobs finished since
+    more than ASYNC_RETENTION seconds, with their files """
+    now = timezone.now()
+    timeout = get_config('ASYNC_TIMEOUT')
+    if timeout is not None:
+        since = now - timedelta(seconds=timeout)
+        ExportJob.objects.filter(
+            Q(status=ExportJob.STATUS_PENDING, created_on__lt=since)
+            | Q(status=ExportJob.STATUS_RUNNING, started_on__lt=since)).update(
+                status=ExportJob.STATUS_FAILED,
+                message='Interrupted',
+                finished_on=now)
+
+    retention = get_config('ASYNC_RETENTION')
+    if retention is None:
+        return
+    expired = ExportJob.objects.filter(
+        finished_on__lt=now - timedelta(seconds=retention))
+    for job in expired.exclude(file=''):
+        job.file.delete(save=False)
+    expired.delete()
+
+
+def run_pending_export_jobs():
+    """ Run all the pending jobs, returns the number of jobs run """
+    cleanup_export_jobs()
+    count = 0
+    for job in ExportJob.objects.filter(status=ExportJob.STATUS_PENDING):
+        if run_export_job(job):
+            count += 1
+    return count
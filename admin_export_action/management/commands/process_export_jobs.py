@@ -0,0 +1,33 @@
+# coding: utf-8
+import time
+
+from django.core.management.base import BaseCommand
+
+from admin_export_action.jobs import run_pending_export_jobs
+
+
+class Command(BaseCommand):
+    help = "Run the pending background exports"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep polling for new jobs instead of exiting',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5,
+            help='Seconds to wait between two polls when no job is pending',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            count = run_pending_export_jobs()
+            if count:
+                self.stdout.write("Run %d export jobs" % count)
+            if not options['loop']:
+                break
+            if not count:
+                time.sleep(options['interval'])
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.2 on 2026-10-18 09:30
+
+import admin_export_action.models
+import admin_export_action.storage
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('selection', models.JSONField(verbose_name='selection')),
+                ('fields', models.JSONField(verbose_name='fields')),
+                ('format', models.CharField(max_length=10, verbose_name='format')),
+                ('raw_choices', models.BooleanField(default=False, verbose_name='raw choices')),
+                ('aggregate_many', models.BooleanField(default=False, verbose_name='aggregate to-many relations')),
+                ('include_header', models.BooleanField(default=True, verbose_name='include header')),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], default='pending', max_length=10, verbose_name='status')),
+                ('file', models.FileField(blank=True, storage=admin_export_action.storage.get_export_storage, upload_to=admin_export_action.models.export_file_path, verbose_name='file')),
+                ('message', models.TextField(blank=True, verbose_name='message')),
+                ('created_on', models.DateTimeField(auto_now_add=True, verbose_name='created on')),
+                ('started_on', models.DateTimeField(blank=True, null=True, verbose_name='started on')),
+                ('finished_on', models.DateTimeField(blank=True, null=True, verbose_name='finished on')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype', verbose_name='content type')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+            options={
+                'verbose_name': 'export job',
+                'verbose_name_plural': 'export jobs',
+                'ordering': ('created_on',),
+            },
+        ),
+    ]
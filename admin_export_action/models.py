@@ -1 +1,76 @@
 # -*- coding: utf-8 -*-
+import os
+import uuid
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+from .storage import get_export_storage
+
+
+def export_file_path(instance, filename):
+    """ Files are named after the job id, which cannot be guessed """
+    return 'export_action/{0}{1}'.format(instance.pk,
+                                         os.path.splitext(filename)[1])
+
+
+class ExportJob(models.Model):
+    """ An export run in background, see jobs.py """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (STATUS_PENDING, _('pending'), ),
+        (STATUS_RUNNING, _('running'), ),
+        (STATUS_DONE, _('done'), ),
+        (STATUS_FAILED, _('failed'), ),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        verbose_name=_('user'),
+        on_delete=models.CASCADE,
+    )
+    content_type = models.ForeignKey(
+        ContentType,
+        verbose_name=_('content type'),
+        on_delete=models.CASCADE,
+    )
+    selection = models.JSONField(_('selection'))
+    fields = models.JSONField(_('fields'))
+    format = models.CharField(_('format'), max_length=10)
+    raw_choices = models.BooleanField(_('raw choices'), default=False)
+    aggregate_many = models.BooleanField(_('aggregate to-many relations'),
+                                         default=False)
+    include_header = models.BooleanField(_('include header'), default=True)
+    status = models.CharField(
+        _('status'),
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING,
+    )
+    file = models.FileField(_('file'),
+                            upload_to=export_file_path,
+                            storage=get_export_storage,
+                            blank=True)
+    message = models.TextField(_('message'), blank=True)
+    created_on = models.DateTimeField(_('created on'), auto_now_add=True)
+    started_on = models.DateTimeField(_('started on'), blank=True, null=True)
+    finished_on = models.DateTimeField(_('finished on'), blank=True, null=True)
+
+    class Meta:
+        verbose_name = _('export job')
+        verbose_name_plural = _('export jobs')
+        ordering = ('created_on', )
+
+    def __str__(self):
+        return '{0} {1}'.format(self.content_type, self.created_on)
+
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_DONE, self.STATUS_FAILED)
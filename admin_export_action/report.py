@@ -3,13 +3,28 @@
 from __future__ import unicode_literals, absolute_import
 
 import json
-from collections import namedtuple
-from itertools import chain
+from collections import OrderedDict, namedtuple
+from itertools import chain, islice
 import csv
+import io
 import re
-from datetime import datetime
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from functools import lru_cache
+from numbers import Number
+from uuid import UUID
 
-from django.http import HttpResponse, JsonResponse
+from django.db import connections
+from django.db.models.expressions import RawSQL
+from django.http import (
+    FileResponse,
+    HttpResponse,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.utils.module_loading import import_string
 
 try:
@@ -19,60 +34,143 @@ except:
         from django.utils.encoding import force_text
     except:
         from django.utils.encoding import force_str as force_text
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.template.defaultfilters import linebreaksbr
 from django.template.loader import render_to_string
 from django.utils import timezone
+from django.utils.functional import Promise
 
 from openpyxl.styles import Font
 from openpyxl.utils import get_column_letter
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.workbook import Workbook
-from tempfile import NamedTemporaryFile
+from tempfile import TemporaryFile
 
 from six import text_type
 
-from .introspection import get_model_from_path_string
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+from . import instrumentation
 from .config import get_config
 
 
 DisplayField = namedtuple("DisplayField", "path field")
+Column = namedtuple("Column", "path fields model verbose_name converter many")
 
+_json_encoder = DjangoJSONEncoder()
 
-def get_field_display_value(objects, path, raw):
-    parts = path.split("__")
-    model = objects.model
-    i = 0
-    for p in parts:
-        if model._meta.get_field(p).related_model:
-            model = model._meta.get_field(p).related_model
-        else:
-            model = model._meta.get_field(p).model
 
-        if i == len(parts) - 1:
-            if (
-                raw is not None
-                and model._meta.get_field(p).choices
-                and len(model._meta.get_field(p).choices)
-            ):
-                return dict(model._meta.get_field(p).choices)[raw]
-            else:
-                return raw
-        i += 1
+@lru_cache(maxsize=None)
+def _resolve_field_path(model_class, path):
+    """Return the tuple of fields traversed by path, starting from
+    model_class, and the model owning the last one.
+    """
+    fields = []
+    model = model_class
+    owner = model_class
+    for p in path.split("__"):
+        field = model._meta.get_field(p)
+        fields.append(field)
+        owner = model
+        if field.related_model:
+            model = field.related_model
+    return tuple(fields), owner
 
 
-def get_field_verbose_name(objects, path):
+def _get_choices_converter(field):
+    choices = dict(field.flatchoices)
+
+    def convert(value):
+        if value is None:
+            return value
+        return choices.get(value, value)
+
+    return convert
+
+
+def _get_verbose_name(fields):
     res = []
-    parts = path.split("__")
-    model = objects.model
-    for p in parts:
-        field = model._meta.get_field(p)
+    for field in fields:
         if hasattr(field, "verbose_name") and field.verbose_name:
             res.append(str(field.verbose_name))
         else:
             res.append(str(field.name))
-        if model._meta.get_field(p).related_model:
-            model = model._meta.get_field(p).related_model
     return " ".join(res)
 
 
+def get_column(model_class, path, raw_choices=False):
+    """Resolve a display path once, returning a Column with the
+    traversed fields, the model owning the last field, the verbose name,
+    the converter to apply to the raw values (None if the raw
+    value has to be exported as is) and the path of the first to-many
+    relation traversed (None if the path only follows to-one relations).
+    """
+    fields, model = _resolve_field_path(model_class, path)
+    field = fields[-1]
+    converter = None
+    if not raw_choices and getattr(field, "choices", None):
+        converter = _get_choices_converter(field)
+    many = None
+    for i, f in enumerate(fields):
+        if f.many_to_many or f.one_to_many:
+            many = "__".join(path.split("__")[: i + 1])
+            break
+    return Column(path, fields, model, _get_verbose_name(fields), converter, many)
+
+
+def get_column_plan(model_class, paths, raw_choices=False):
+    """Resolve all the display paths of an export"""
+    return [get_column(model_class, path, raw_choices) for path in paths]
+
+
+def _get_row_converter(columns):
+    """Return a function converting a raw values_list record into a
+    list of display values, touching only the columns which need it.
+    """
+    converters = [
+        (i, column.converter)
+        for i, column in enumerate(columns)
+        if column.converter is not None
+    ]
+
+    def convert(record):
+        row = list(record)
+        for i, converter in converters:
+            row[i] = converter(row[i])
+        return row
+
+    return convert
+
+
+def get_field_display_value(objects, path, raw):
+    column = get_column(objects.model, path)
+    if column.converter is None:
+        return raw
+    return column.converter(raw)
+
+
+def get_field_verbose_name(objects, path):
+    fields, model = _resolve_field_path(objects.model, path)
+    return _get_verbose_name(fields)
+
+
 def generate_filename(title, ends_with):
     title = title.split(".")[0]
     title.replace(" ", "_")
@@ -94,164 +192,884 @@ def _can_change_or_view(model, user):
     return can_change or can_view
 
 
-def report_to_list(queryset, display_fields, user, raw_choices=False):
+class PermissionResolver(object):
+    """Check the change or view permission of a user on models, once per
+    model: permission backends may hit the database on every check.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._cache = {}
+
+    def can_change_or_view(self, model):
+        try:
+            return self._cache[model]
+        except KeyError:
+            allowed = self._cache[model] = _can_change_or_view(model, self.user)
+            return allowed
+
+
+def filter_by_pks(queryset, ids):
+    """Filter queryset by the given primary keys.
+
+    Above the PK_IN_THRESHOLD setting the ids are not sent as one bound
+    parameter each (which hits the SQLite variables limit and produces
+    huge query strings on PostgreSQL), but as a single array or json
+    parameter joined as a set, keeping the queryset ordering.
+    Other backends always get a plain pk__in lookup.
+    """
+    threshold = get_config("PK_IN_THRESHOLD")
+    if threshold is None or len(ids) <= threshold:
+        return queryset.filter(pk__in=ids)
+
+    connection = connections[queryset.db]
+    pk = queryset.model._meta.pk
+    values = [
+        pk.get_db_prep_value(pk.to_python(value), connection) for value in ids
+    ]
+    if connection.vendor == "postgresql":
+        pks = RawSQL("SELECT unnest(%s)", (values,))
+    elif connection.vendor == "sqlite":
+        pks = RawSQL(
+            "SELECT value FROM json_each(%s)",
+            (json.dumps(values, cls=DjangoJSONEncoder),),
+        )
+    else:
+        return queryset.filter(pk__in=ids)
+    return queryset.filter(pk__in=pks)
+
+
+def _prepare_report(
+    queryset, display_fields, user, raw_choices=False, permissions=None
+):
+    """Resolve the columns the user is allowed to export.
+
+    Returns list of columns, message in case of issues.
+    Columns are None if the user cannot access the queryset model at all.
+    """
+    model_class = queryset.model
+    if permissions is None:
+        permissions = PermissionResolver(user)
+
+    if not permissions.can_change_or_view(model_class):
+        return None, "Permission Denied"
+
+    columns = []
+    message = ""
+    for column in get_column_plan(model_class, display_fields, raw_choices):
+        if permissions.can_change_or_view(column.model):
+            columns.append(column)
+        else:
+            message += "Error: Permission denied on access to {0}.".format(
+                column.path
+            )
+    instrumentation.set_columns(len(columns))
+    return columns, message
+
+
+def _aggregate_values(values, separator):
+    if separator is None:
+        return json_dumps(values).decode("utf-8")
+    return separator.join(force_text(value) for value in values)
+
+
+def _get_aggregating_converter(model_class, columns):
+    """Return a function converting a chunk of parent records (pk followed
+    by the to-one columns) into rows, loading every to-many relation with
+    one query per chunk and aggregating its values in a single cell.
+    """
+    separator = get_config("TO_MANY_SEPARATOR")
+    single = [i for i, column in enumerate(columns) if column.many is None]
+    groups = OrderedDict()
+    for i, column in enumerate(columns):
+        if column.many is not None:
+            groups.setdefault(column.many, []).append(i)
+
+    def convert(chunk):
+        pks = [record[0] for record in chunk]
+        aggregated = {}
+        for many, indexes in groups.items():
+            values = aggregated[many] = {pk: [[] for i in indexes] for pk in pks}
+            with instrumentation.phase("sql"):
+                children = list(
+                    model_class._base_manager.filter(pk__in=pks)
+                    .order_by("pk", many + "__pk")
+                    .values_list("pk", *[columns[i].path for i in indexes])
+                )
+            for record in children:
+                if all(value is None for value in record[1:]):
+                    continue  # no related objects
+                for column_values, i, value in zip(
+                    values[record[0]], indexes, record[1:]
+                ):
+                    converter = columns[i].converter
+                    column_values.append(
+                        value if converter is None else converter(value)
+                    )
+
+        rows = []
+        for record in chunk:
+            row = [None] * len(columns)
+            for i, value in zip(single, record[1:]):
+                converter = columns[i].converter
+                row[i] = value if converter is None else converter(value)
+            for many, indexes in groups.items():
+                for i, values in zip(indexes, aggregated[many][record[0]]):
+                    row[i] = _aggregate_values(values, separator)
+            rows.append(row)
+        return rows
+
+    return convert
+
+
+def _iter_chunks(records, chunk_size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _convert_records(records, model_class, columns, chunk_size, aggregate_many=False):
+    """Convert raw records into rows a chunk at a time, accounting the
+    fetch of the records to the sql phase and their conversion to the
+    convert phase"""
+    if aggregate_many:
+        convert_chunk = _get_aggregating_converter(model_class, columns)
+    else:
+        convert = _get_row_converter(columns)
+
+        def convert_chunk(chunk):
+            return [convert(record) for record in chunk]
+
+    records = iter(records)
+    while True:
+        with instrumentation.phase("sql"):
+            chunk = list(islice(records, chunk_size))
+        if not chunk:
+            break
+        with instrumentation.phase("convert"):
+            rows = convert_chunk(chunk)
+        instrumentation.add_rows(len(rows))
+        for row in rows:
+            yield row
+
+
+def _get_values_list(queryset, columns, aggregate_many=False):
+    if aggregate_many:
+        return queryset.values_list(
+            "pk", *[column.path for column in columns if column.many is None]
+        )
+    return queryset.values_list(*[column.path for column in columns])
+
+
+def _iter_rows(queryset, columns, chunk_size=None, aggregate_many=False):
+    if chunk_size is None:
+        chunk_size = get_config("CHUNK_SIZE")
+
+    values_list = _get_values_list(queryset, columns, aggregate_many)
+    records = values_list.iterator(chunk_size=chunk_size)
+    return _convert_records(
+        records, queryset.model, columns, chunk_size, aggregate_many
+    )
+
+
+def report_to_list(
+    queryset, display_fields, user, raw_choices=False, aggregate_many=False
+):
     """Create list from a report with all data filtering.
 
     queryset: initial queryset to generate results
     display_fields: list of field references or DisplayField models
     user: requesting user
+    aggregate_many: export one row per object, joining the values of
+        to-many relations in a single cell
 
     Returns list, message in case of issues.
     """
+    columns, message = _prepare_report(queryset, display_fields, user, raw_choices)
+    if columns is None:
+        return [], message
+
+    values_list = _get_values_list(queryset, columns, aggregate_many)
+    rows = _convert_records(
+        values_list, queryset.model, columns, get_config("CHUNK_SIZE"), aggregate_many
+    )
+    return list(rows), message
+
+
+def report_to_iterator(
+    queryset,
+    display_fields,
+    user,
+    raw_choices=False,
+    chunk_size=None,
+    aggregate_many=False,
+):
+    """Same as report_to_list, but rows are lazily fetched from the
+    database in chunks of `chunk_size` rows and converted one by one,
+    so memory usage does not depend on the number of exported rows.
+
+    Returns iterator, message in case of issues.
+    """
+    columns, message = _prepare_report(queryset, display_fields, user, raw_choices)
+    if columns is None:
+        return iter([]), message
+
+    return _iter_rows(queryset, columns, chunk_size, aggregate_many), message
+
+
+def _build_sheet_rows(queryset, pk_column, many, columns, chunk_size):
+    """Rows of one sheet of report_to_sheets, the parent pk followed by
+    the values of columns"""
+    if many is None:
+        values_list = queryset
+    else:
+        values_list = queryset.model._base_manager.filter(
+            pk__in=queryset.values("pk")
+        ).order_by("pk", many + "__pk")
+    values_list = values_list.values_list("pk", *[column.path for column in columns])
+
+    convert = _get_row_converter([pk_column] + columns)
+    rows = []
+    for record in values_list.iterator(chunk_size=chunk_size):
+        if many is not None and all(value is None for value in record[1:]):
+            continue  # no related objects
+        rows.append(convert(record))
+    return rows
+
+
+def _build_sheet_rows_in_thread(*args):
+    try:
+        return _build_sheet_rows(*args)
+    finally:
+        # worker threads own their database connections
+        connections.close_all()
+
+
+def _build_sheets(args, workers):
+    if workers > 1:
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="admin_export_action"
+        ) as executor:
+            futures = [executor.submit(_build_sheet_rows_in_thread, *a) for a in args]
+            results = [future.result() for future in futures]
+        return results
+    return [_build_sheet_rows(*a) for a in args]
+
+
+def report_to_sheets(
+    queryset, display_fields, user, raw_choices=False, title="report"
+):
+    """Create one sheet for the parent model and one for every to-many
+    relation traversed by display_fields, every sheet starting with the
+    parent pk. Sheets are queried and converted concurrently by
+    SHEET_WORKERS threads. Threads use database connections of their
+    own, outside the transaction of the caller: with ATOMIC_REQUESTS, or
+    inside atomic(), sheets may see a different snapshot than the parent
+    query, and not the uncommitted changes of the transaction.
+
+    Returns dict of sheet name: rows, dict of sheet name: header, message
+    in case of issues.
+    """
+    sheets = OrderedDict()
+    headers = OrderedDict()
+    columns, message = _prepare_report(queryset, display_fields, user, raw_choices)
+    if columns is None:
+        return sheets, headers, message
+
     model_class = queryset.model
-    objects = queryset
-    message = ""
+    pk_column = get_column(model_class, model_class._meta.pk.name)
+    groups = OrderedDict([(None, [])])
+    for column in columns:
+        groups.setdefault(column.many, []).append(column)
 
-    if not _can_change_or_view(model_class, user):
-        return [], "Permission Denied"
+    for many, group in groups.items():
+        name = title if many is None else many
+        headers[name] = [
+            pk_column.verbose_name
+            if many is None
+            else "%s %s" % (model_class._meta.verbose_name, pk_column.verbose_name)
+        ] + [column.verbose_name for column in group]
 
-    # Convert list of strings to DisplayField objects.
-    new_display_fields = []
+    chunk_size = get_config("CHUNK_SIZE")
+    args = [
+        (queryset, pk_column, many, group, chunk_size)
+        for many, group in groups.items()
+    ]
+    workers = min(get_config("SHEET_WORKERS") or 1, len(args))
+    # sheets are fetched and converted at once, possibly concurrently, the
+    # whole stage is accounted to the sql phase
+    with instrumentation.phase("sql"):
+        results = _build_sheets(args, workers)
 
-    for display_field in display_fields:
-        field_list = display_field.split("__")
-        field = field_list[-1]
-        path = "__".join(field_list[:-1])
+    for name, rows in zip(headers, results):
+        instrumentation.add_rows(len(rows))
+        sheets[name] = rows
+    return sheets, headers, message
 
-        if path:
-            path += "__"  # Legacy format to append a __ here.
 
-        df = DisplayField(path, field)
-        new_display_fields.append(df)
+def report_to_page(
+    queryset,
+    display_fields,
+    user,
+    raw_choices=False,
+    page_number=1,
+    per_page=None,
+    aggregate_many=False,
+):
+    """Same as report_to_list, but only the rows of the requested page
+    are fetched from the database (LIMIT/OFFSET).
 
-    display_fields = new_display_fields
+    Returns page, list, message in case of issues.
+    """
+    columns, message = _prepare_report(queryset, display_fields, user, raw_choices)
+    if columns is None:
+        return None, [], message
 
-    # Display Values
-    display_field_paths = []
+    if per_page is None:
+        per_page = get_config("HTML_PAGE_SIZE")
+    if not queryset.ordered:
+        # pages need a stable ordering
+        queryset = queryset.order_by("pk")
 
-    for i, display_field in enumerate(display_fields):
-        model = get_model_from_path_string(model_class, display_field.path)
+    values_list = _get_values_list(queryset, columns, aggregate_many)
+    page = Paginator(values_list, per_page).get_page(page_number)
+    rows = _convert_records(
+        page.object_list, queryset.model, columns, per_page, aggregate_many
+    )
+    return page, list(rows), message
 
-        if not model or _can_change_or_view(model, user):
-            display_field_key = display_field.path + display_field.field
 
-            display_field_paths.append(display_field_key)
+def _can_copy(queryset, columns, raw_choices=False, aggregate_many=False):
+    """Whether the export can be written by the database: only on
+    PostgreSQL, for the raw values of plain database columns"""
+    if connections[queryset.db].vendor != "postgresql":
+        return False
+    if not raw_choices or aggregate_many or not columns:
+        return False
+    return all(
+        column.converter is None and not hasattr(column.fields[-1], "from_db_value")
+        for column in columns
+    )
 
-        else:
-            message += "Error: Permission denied on access to {0}.".format(
-                display_field.name
-            )
 
-    values_list = objects.values_list(*display_field_paths)
-    values_and_properties_list = [list(row) for row in values_list]
-
-    if not raw_choices:
-        return list(
-            map(
-                lambda record: list(
-                    map(
-                        lambda p, v: get_field_display_value(objects, p, v),
-                        display_field_paths,
-                        record,
-                    )
-                ),
-                values_and_properties_list,
-            )
-        ), message
+def iter_copy_csv(queryset, columns, header=None, chunk_size=64 * 1024):
+    """Yield the csv export of queryset as written by PostgreSQL
+    COPY ... TO STDOUT, in chunks of about `chunk_size` bytes.
+    With psycopg 3 the chunks are yielded as PostgreSQL sends them, with
+    psycopg2 they are spooled to a temporary file first, so the first
+    chunk comes once the whole COPY has run."""
+    if header:
+        buffer = io.StringIO()
+        # rows written by COPY end with \n only
+        csv.writer(buffer, lineterminator="\n").writerow(
+            [force_text(s) for s in header]
+        )
+        yield buffer.getvalue().encode("utf-8")
+
+    sql, params = _get_values_list(queryset, columns).query.sql_with_params()
+    copy_sql = "COPY (%s) TO STDOUT WITH (FORMAT csv, ENCODING 'UTF8')" % sql
+    connection = connections[queryset.db]
+    with connection.cursor() as cursor:
+        raw_cursor = cursor.cursor
+        if hasattr(raw_cursor, "copy"):  # psycopg 3, binds params client side
+            with raw_cursor.copy(copy_sql, params) as copy:
+                chunk = []
+                size = 0
+                for data in copy:
+                    chunk.append(bytes(data))
+                    size += len(data)
+                    if size >= chunk_size:
+                        yield b"".join(chunk)
+                        chunk = []
+                        size = 0
+                if chunk:
+                    yield b"".join(chunk)
+            # the number of copied rows
+            instrumentation.add_rows(max(raw_cursor.rowcount, 0))
+        else:  # psycopg2 can only copy to a file
+            with TemporaryFile() as tmp:
+                raw_cursor.copy_expert(raw_cursor.mogrify(copy_sql, params), tmp)
+                instrumentation.add_rows(max(raw_cursor.rowcount, 0))
+                tmp.seek(0)
+                for data in iter(lambda: tmp.read(chunk_size), b""):
+                    yield data
+
+
+def report_to_copy_csv(
+    queryset,
+    display_fields,
+    user,
+    raw_choices=False,
+    aggregate_many=False,
+    header=None,
+):
+    """Same as report_to_iterator followed by iter_csv, but the csv is
+    written by PostgreSQL COPY, without any row loop in Python. Values are
+    formatted by PostgreSQL: NULL is an empty string, booleans are t and
+    f, datetimes have a numeric timezone offset.
+    When the export cannot be written by the database (on other backends,
+    without raw choices, when aggregating to-many relations or for fields
+    converting their database values) the rows of the same columns are
+    written by iter_csv.
+
+    Returns iterator of csv chunks, message in case of issues.
+    """
+    columns, message = _prepare_report(queryset, display_fields, user, raw_choices)
+    if columns is None:
+        return iter([]), message
+    if not _can_copy(queryset, columns, raw_choices, aggregate_many):
+        rows = _iter_rows(queryset, columns, aggregate_many=aggregate_many)
+        return iter_csv(rows, header), message
+    return iter_copy_csv(queryset, columns, header), message
+
+
+ARROW_INTEGER_TYPES = (
+    "AutoField",
+    "BigAutoField",
+    "SmallAutoField",
+    "IntegerField",
+    "BigIntegerField",
+    "SmallIntegerField",
+    "PositiveIntegerField",
+    "PositiveBigIntegerField",
+    "PositiveSmallIntegerField",
+)
+
+
+def _get_internal_type(field):
+    if getattr(field, "target_field", None) is not None:
+        # foreign keys are exported as the value of their target field
+        return _get_internal_type(field.target_field)
+    return field.get_internal_type()
+
+
+def _get_arrow_column(column, aggregate_many=False):
+    """Return the arrow type of a column and the function preparing its
+    values for pyarrow.array"""
+    field = column.fields[-1]
+    if column.converter is not None or (aggregate_many and column.many):
+        internal_type = None  # display values and aggregated values
     else:
-        return values_and_properties_list, message
+        internal_type = _get_internal_type(field)
 
+    if internal_type in ARROW_INTEGER_TYPES:
+        return pyarrow.int64(), None
+    elif internal_type == "BooleanField":
+        return pyarrow.bool_(), None
+    elif internal_type == "FloatField":
+        return pyarrow.float64(), None
+    elif internal_type == "DecimalField" and field.max_digits <= 38:
+        return pyarrow.decimal128(field.max_digits, field.decimal_places), None
+    elif internal_type == "DateField":
+        return pyarrow.date32(), None
+    elif internal_type == "DateTimeField":
+        return pyarrow.timestamp("us", tz="UTC" if settings.USE_TZ else None), None
+    elif internal_type == "TimeField":
+        return pyarrow.time64("us"), None
+    elif internal_type == "DurationField":
+        return pyarrow.duration("us"), None
+    elif internal_type == "BinaryField":
+        return pyarrow.binary(), bytes
+    elif internal_type == "JSONField":
+        return pyarrow.string(), lambda value: json_dumps(value).decode("utf-8")
+    return pyarrow.string(), force_text
 
-def build_sheet(data, ws, sheet_name="report", header=None, widths=None):
-    first_row = 1
-    column_base = 1
 
-    func = None
-    if get_config("VALUE_TO_XLSX_CELL") is not None:
-        try:
-            func = import_string(get_config("VALUE_TO_XLSX_CELL"))
-        except Exception as e:
-            pass
+def report_to_arrow(
+    queryset,
+    display_fields,
+    user,
+    raw_choices=False,
+    chunk_size=None,
+    aggregate_many=False,
+    verbose_names=False,
+):
+    """Same as report_to_iterator, but rows are returned as pyarrow record
+    batches of `chunk_size` rows, typed after the model fields.
+    Columns are named after the field paths, or their verbose names if
+    verbose_names is True.
 
-    ws.title = re.sub(r"\W+", "", sheet_name)[:30]
-    if header:
-        for i, header_cell in enumerate(header):
-            cell = ws.cell(row=first_row, column=i + column_base)
-            cell.value = header_cell
-            cell.font = Font(bold=True)
-            if widths:
-                ws.column_dimensions[get_column_letter(i + 1)].width = widths[i]
+    Returns schema, iterator of record batches, message in case of issues.
+    """
+    columns, message = _prepare_report(queryset, display_fields, user, raw_choices)
+    if columns is None:
+        return pyarrow.schema([]), iter([]), message
 
-    for row in data:
-        for i in range(len(row)):
-            item = row[i]
-            # If item is a regular string
-            success = False
-            if func:
-                success, res = func(item)
+    if chunk_size is None:
+        chunk_size = get_config("CHUNK_SIZE")
+
+    names = []
+    for column in columns:
+        name = column.verbose_name if verbose_names else column.path
+        while name in names:
+            name += "_"
+        names.append(name)
+    arrow_columns = [_get_arrow_column(column, aggregate_many) for column in columns]
+    schema = pyarrow.schema(
+        [(name, arrow_type) for name, (arrow_type, prepare) in zip(names, arrow_columns)]
+    )
+
+    def batches():
+        rows = _iter_rows(queryset, columns, chunk_size, aggregate_many)
+        for chunk in _iter_chunks(rows, chunk_size):
+            arrays = []
+            for i, (arrow_type, prepare) in enumerate(arrow_columns):
+                values = [row[i] for row in chunk]
+                if prepare is not None:
+                    values = [None if v is None else prepare(v) for v in values]
+                arrays.append(pyarrow.array(values, type=arrow_type))
+            yield pyarrow.record_batch(arrays, schema=schema)
+
+    return schema, batches(), message
+
+
+def _arrow_file_response(tmp, title, ends_with, content_type):
+    tmp.seek(0)
+    return FileResponse(
+        tmp,
+        as_attachment=True,
+        filename=generate_filename(title, ends_with),
+        content_type=content_type,
+    )
+
+
+def arrow_to_parquet_response(schema, batches, title="report"):
+    """Write record batches to a parquet file, one row group per batch,
+    and return a file response for download"""
+    tmp = TemporaryFile()
+    with pyarrow.parquet.ParquetWriter(tmp, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+    return _arrow_file_response(
+        tmp, title, ".parquet", "application/vnd.apache.parquet"
+    )
+
+
+def arrow_to_ipc_response(schema, batches, title="report"):
+    """Write record batches to an Arrow IPC file and return a file
+    response for download"""
+    tmp = TemporaryFile()
+    with pyarrow.ipc.new_file(tmp, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+    return _arrow_file_response(
+        tmp, title, ".arrow", "application/vnd.apache.arrow.file"
+    )
+
+
+def _datetime_to_cell(value):
+    return value.replace(tzinfo=None)
+
+
+def _decimal_to_cell(value):
+    # NaN and infinity have no xlsx numeric representation
+    return value if value.is_finite() else str(value)
+
+
+def _list_to_cell(value):
+    return json.dumps(value)
+
+
+_cell_converters = {
+    datetime: _datetime_to_cell,
+    str: None,
+    dict: text_type,
+    list: _list_to_cell,
+    UUID: str,
+    Promise: str,  # lazy translation strings
+    Decimal: _decimal_to_cell,
+}
+_cell_converters_cache = {}
+
+
+def register_cell_converter(value_type, converter):
+    """Register the function used to convert values of value_type (and
+    its subclasses) to their xlsx representation. Use None as converter
+    to leave values untouched.
+    """
+    _cell_converters[value_type] = converter
+    _cell_converters_cache.clear()
+
+
+def get_cell_converter(value_type):
+    """Return the converter registered for value_type or for its closest
+    base class, None if values can be written as they are.
+    The lookup is memoized per concrete type.
+    """
+    try:
+        return _cell_converters_cache[value_type]
+    except KeyError:
+        converter = None
+        for klass in value_type.__mro__:
+            if klass in _cell_converters:
+                converter = _cell_converters[klass]
+                break
+        _cell_converters_cache[value_type] = converter
+        return converter
+
+
+@lru_cache(maxsize=None)
+def _import_value_to_xlsx_cell(path):
+    try:
+        return import_string(path)
+    except Exception as e:
+        return None
+
+
+def _get_value_to_xlsx_cell():
+    path = get_config("VALUE_TO_XLSX_CELL")
+    if path is None:
+        return None
+    return _import_value_to_xlsx_cell(path)
+
+
+def _convert_row(row, func=None):
+    """Convert in place every value of row to its xlsx representation"""
+    for i, item in enumerate(row):
+        if func:
+            success, res = func(item)
             if success:
                 row[i] = res
-            else:
-                if isinstance(item, datetime):
-                    row[i] = item.replace(tzinfo=None)
-                elif isinstance(item, str):
-                    # Change it to a unicode string
-                    try:
-                        row[i] = text_type(item)
-                    except UnicodeDecodeError:
-                        row[i] = text_type(item.decode("utf-8", "ignore"))
-                elif type(item) is dict:
-                    row[i] = text_type(item)
-                elif (
-                    type(item).__name__ == "UUID" or type(item).__name__ == "__proxy__"
-                ):
-                    row[i] = str(item)
-                elif type(item).__name__ == "list":
-                    row[i] = json.dumps(item)
-        try:
-            ws.append(row)
-        except ValueError as e:
-            ws.append([str(e)])
-        except:
-            ws.append(["Unknown Error"])
+                continue
+        converter = get_cell_converter(type(item))
+        if converter is not None:
+            row[i] = converter(item)
+    return row
+
+
+def _append_row(ws, row):
+    try:
+        ws.append(row)
+    except ValueError as e:
+        ws.append([str(e)])
+    except:
+        ws.append(["Unknown Error"])
+
+
+def _sheet_title(sheet_name, part=1):
+    """Title of the part-th worksheet of sheet_name: "report", "report_2"..."""
+    suffix = "_%d" % part if part > 1 else ""
+    return re.sub(r"\W+", "", sheet_name)[:30 - len(suffix)] + suffix
+
+
+def _split_rows(data, header=None):
+    """Split the rows of data in parts fitting a worksheet, header
+    included, lazily: every part has to be consumed before the next one
+    is requested. The first part is always yielded, even if empty."""
+    max_rows = get_config("XLSX_MAX_ROWS") - (1 if header else 0)
+    rows = iter(data)
+    yield islice(rows, max_rows)
+    for row in rows:
+        yield chain([row], islice(rows, max_rows - 1))
+
+
+def _write_header(ws, header, widths=None):
+    for i, header_cell in enumerate(header):
+        cell = ws.cell(row=1, column=i + 1)
+        cell.value = header_cell
+        cell.font = Font(bold=True)
+        if widths:
+            ws.column_dimensions[get_column_letter(i + 1)].width = widths[i]
+
+
+def build_sheet(data, ws, sheet_name="report", header=None, widths=None):
+    """Write the rows of data to ws. Rows past XLSX_MAX_ROWS are written
+    to new worksheets of the same workbook, "report_2", "report_3"...,
+    each one with the header."""
+    func = _get_value_to_xlsx_cell()
+
+    for part, rows in enumerate(_split_rows(data, header), 1):
+        if part > 1:
+            ws = ws.parent.create_sheet(title=_sheet_title(sheet_name, part))
+        else:
+            ws.title = _sheet_title(sheet_name)
+        if header:
+            _write_header(ws, header, widths)
+
+        for row in rows:
+            _append_row(ws, _convert_row(row, func))
+
+
+def build_write_only_sheet(data, ws, header=None, widths=None):
+    """Same as build_sheet, but for worksheets of a write-only workbook.
+    data can be any iterable of rows, rows are written to disk as soon as
+    they are appended, so memory usage depends on the width of a row only.
+    """
+    func = _get_value_to_xlsx_cell()
+
+    sheet_name = ws.title
+    for part, rows in enumerate(_split_rows(data, header), 1):
+        if part > 1:
+            ws = ws.parent.create_sheet(title=_sheet_title(sheet_name, part))
+        if widths:
+            for i, width in enumerate(widths):
+                ws.column_dimensions[get_column_letter(i + 1)].width = width
+        if header:
+            header_row = []
+            for header_cell in header:
+                cell = WriteOnlyCell(ws, value=header_cell)
+                cell.font = Font(bold=True)
+                header_row.append(cell)
+            ws.append(header_row)
+
+        for row in rows:
+            _append_row(ws, _convert_row(list(row), func))
+
+
+@lru_cache(maxsize=None)
+def _get_xlsxwriter_method(value_type):
+    """Return the name of the typed XlsxWriter write method for
+    value_type, and the name of the cell format to use"""
+    if issubclass(value_type, bool):
+        return "write_boolean", None
+    elif issubclass(value_type, Number):
+        return "write_number", None
+    elif issubclass(value_type, datetime):
+        return "write_datetime", "datetime"
+    elif issubclass(value_type, date):
+        return "write_datetime", "date"
+    elif issubclass(value_type, time):
+        return "write_datetime", "time"
+    elif issubclass(value_type, timedelta):
+        return "write_datetime", "timedelta"
+    return "write_string", None
+
+
+def _add_xlsxwriter_formats(wb):
+    # the number formats openpyxl uses
+    return {
+        "bold": wb.add_format({"bold": True}),
+        "datetime": wb.add_format({"num_format": "yyyy-mm-dd h:mm:ss"}),
+        "date": wb.add_format({"num_format": "yyyy-mm-dd"}),
+        "time": wb.add_format({"num_format": "h:mm:ss"}),
+        "timedelta": wb.add_format({"num_format": "[hh]:mm:ss"}),
+    }
+
+
+def build_xlsxwriter_sheet(
+    data, wb, formats, sheet_name="report", header=None, widths=None
+):
+    """Same as build_write_only_sheet, adding the worksheets of sheet_name
+    to a XlsxWriter workbook in constant_memory mode: every row is written
+    as soon as it is produced, each cell with the write method of its type.
+    formats are the ones of _add_xlsxwriter_formats.
+    """
+    func = _get_value_to_xlsx_cell()
+
+    for part, rows in enumerate(_split_rows(data, header), 1):
+        ws = wb.add_worksheet(_sheet_title(sheet_name, part))
+        if widths:
+            for i, width in enumerate(widths):
+                ws.set_column(i, i, width)
+        row_index = 0
+        if header:
+            for i, header_cell in enumerate(header):
+                ws.write_string(row_index, i, force_text(header_cell), formats["bold"])
+            row_index += 1
+
+        for row in rows:
+            row = _convert_row(list(row), func)
+            for i, value in enumerate(row):
+                if value is None:
+                    continue
+                method, format_name = _get_xlsxwriter_method(type(value))
+                if method == "write_string":
+                    value = force_text(value)
+                if format_name is None:
+                    getattr(ws, method)(row_index, i, value)
+                else:
+                    getattr(ws, method)(row_index, i, value, formats[format_name])
+            row_index += 1
+
+
+def xlsxwriter_to_xlsx_response(data, title="report", header=None, widths=None):
+    """Make an iterable of rows, or a dict of sheets like list_to_workbook,
+    into a xlsx response for download, written by XlsxWriter in
+    constant_memory mode.
+    """
+    tmp = TemporaryFile()
+    wb = xlsxwriter.Workbook(
+        tmp,
+        {
+            "constant_memory": True,
+            "remove_timezone": True,
+            "nan_inf_to_errors": True,
+        },
+    )
+    formats = _add_xlsxwriter_formats(wb)
+    sheets = data.items() if isinstance(data, dict) else [(title, data)]
+    for sheet_name, sheet_data in sheets:
+        build_xlsxwriter_sheet(
+            sheet_data,
+            wb,
+            formats,
+            sheet_name=sheet_name,
+            header=header.get(sheet_name) if isinstance(header, dict) else header,
+            widths=widths,
+        )
+    with instrumentation.phase("save"):
+        wb.close()
+    return _xlsx_file_response(tmp, title)
+
+
+def _use_xlsxwriter():
+    return get_config("XLSX_BACKEND") == "xlsxwriter" and xlsxwriter is not None
 
 
 def list_to_workbook(data, title="report", header=None, widths=None):
-    """Create just a openpxl workbook from a list of data"""
+    """Create just a openpxl workbook from a list of data.
+    If data is a dict of sheets, header can be a dict of sheet headers."""
     wb = Workbook()
     title = re.sub(r"\W+", "", title)[:30]
 
     if isinstance(data, dict):
-        i = 0
-        for sheet_name, sheet_data in data.items():
-            if i > 0:
-                wb.create_sheet()
-            ws = wb.worksheets[i]
-            build_sheet(sheet_data, ws, sheet_name=sheet_name, header=header)
-            i += 1
+        for i, (sheet_name, sheet_data) in enumerate(data.items()):
+            # sheets past XLSX_MAX_ROWS rows are split in several worksheets
+            ws = wb.worksheets[0] if i == 0 else wb.create_sheet()
+            build_sheet(
+                sheet_data,
+                ws,
+                sheet_name=sheet_name,
+                header=header.get(sheet_name) if isinstance(header, dict) else header,
+            )
     else:
         ws = wb.worksheets[0]
         build_sheet(data, ws, header=header, widths=widths)
     return wb
 
 
+def iter_to_workbook(data, title="report", header=None, widths=None):
+    """Create a write-only openpyxl workbook from an iterable of rows"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=_sheet_title(title))
+    build_write_only_sheet(data, ws, header=header, widths=widths)
+    return wb
+
+
 def build_xlsx_response(wb, title="report"):
-    """Take a workbook and return a xlsx file response"""
-    title = generate_filename(title, ".xlsx")
-    response = HttpResponse(
-        content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
-    with NamedTemporaryFile() as tmp:
-        wb.save(tmp.name)
-        tmp.seek(0)
-        response = HttpResponse(
-            tmp.read(),
-            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        )
-        response["Content-Disposition"] = "attachment; filename=%s" % title
-        response["Content-Length"] = tmp.tell()
+    """Take a workbook and return a xlsx file response.
+    The workbook is saved to a temporary file which is then streamed
+    to the client in chunks, and removed as soon as the response is closed.
+    """
+    tmp = TemporaryFile()
+    with instrumentation.phase("save"):
+        wb.save(tmp)
+    return _xlsx_file_response(tmp, title)
 
-        return response
+
+def _xlsx_file_response(tmp, title):
+    tmp.seek(0)
+    return FileResponse(
+        tmp,
+        as_attachment=True,
+        filename=generate_filename(title, ".xlsx"),
+        content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    )
 
 
 def list_to_xlsx_response(data, title="report", header=None, widths=None):
@@ -259,11 +1077,24 @@ def list_to_xlsx_response(data, title="report", header=None, widths=None):
     data can be a 2d array or a dict of 2d arrays
     like {'sheet_1': [['A1', 'B1']]}
     """
+    if _use_xlsxwriter():
+        return xlsxwriter_to_xlsx_response(data, title, header, widths)
 
     wb = list_to_workbook(data, title, header, widths)
     return build_xlsx_response(wb, title=title)
 
 
+def iter_to_xlsx_response(data, title="report", header=None, widths=None):
+    """Make an iterable of rows into a xlsx response for download,
+    using a constant memory write-only workbook.
+    """
+    if _use_xlsxwriter():
+        return xlsxwriter_to_xlsx_response(data, title, header, widths)
+
+    wb = iter_to_workbook(data, title, header, widths)
+    return build_xlsx_response(wb, title=title)
+
+
 def list_to_csv_response(data, title="report", header=None):
     """Make 2D list into a csv response for download data."""
     response = HttpResponse(content_type="text/csv; charset=UTF-8")
@@ -275,6 +1106,42 @@ def list_to_csv_response(data, title="report", header=None):
     return response
 
 
+def iter_csv(data, header=None, chunk_size=None):
+    """Encode rows as csv, yielding one string every `chunk_size` rows"""
+    if chunk_size is None:
+        chunk_size = get_config("CHUNK_SIZE")
+    buffer = io.StringIO()
+    cw = csv.writer(buffer)
+
+    for i, row in enumerate(chain([header] if header else [], data), 1):
+        cw.writerow([force_text(s) for s in row])
+        if i % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_to_csv_response(data, title="report", header=None):
+    """Make an iterable of rows into a streaming csv response for download.
+    Rows are consumed lazily while the response is sent."""
+    response = StreamingHttpResponse(
+        iter_csv(data, header), content_type="text/csv; charset=UTF-8"
+    )
+    response["Content-Disposition"] = 'attachment; filename="%s.csv"' % title
+    return response
+
+
+def csv_chunks_to_response(chunks, title="report"):
+    """Make an iterable of csv chunks, like the ones of
+    report_to_copy_csv, into a streaming csv response for download"""
+    response = StreamingHttpResponse(chunks, content_type="text/csv; charset=UTF-8")
+    response["Content-Disposition"] = 'attachment; filename="%s.csv"' % title
+    return response
+
+
 def list_to_json_response(data, title="report", header=None):
     """Make 2D list into a json response for download data."""
     if not header:
@@ -296,6 +1163,255 @@ def list_to_json_response(data, title="report", header=None):
     return response
 
 
-def list_to_html_response(data, title="", header=None):
-    html = render_to_string("export_action/report_html.html", locals())
+def _json_default(value):
+    return _json_encoder.default(value)
+
+
+if orjson is not None:
+
+    def json_dumps(value):
+        """Encode value as json bytes, using orjson when installed"""
+        return orjson.dumps(
+            value,
+            default=_json_default,
+            # leave dates to DjangoJSONEncoder, which formats them as the
+            # fallback below does
+            option=orjson.OPT_PASSTHROUGH_DATETIME,
+        )
+
+else:
+
+    def json_dumps(value):
+        """Encode value as json bytes, using orjson when installed"""
+        # compact and not escaped, as orjson writes it
+        return json.dumps(
+            value, cls=DjangoJSONEncoder, separators=(",", ":"), ensure_ascii=False
+        ).encode("utf-8")
+
+
+def _iter_records(data, header=None):
+    if not header:
+        return iter(data)
+    return (dict(zip(header, record)) for record in data)
+
+
+def iter_json(data, header=None, chunk_size=None):
+    """Encode rows as a json array, yielding bytes every `chunk_size` rows"""
+    if chunk_size is None:
+        chunk_size = get_config("CHUNK_SIZE")
+    separator = b"["
+    chunk = []
+
+    for record in _iter_records(data, header):
+        chunk.append(json_dumps(record))
+        if len(chunk) >= chunk_size:
+            yield separator + b",".join(chunk)
+            separator = b","
+            chunk = []
+
+    if chunk:
+        yield separator + b",".join(chunk)
+    elif separator == b"[":
+        yield separator
+    yield b"]"
+
+
+def iter_ndjson(data, header=None, chunk_size=None):
+    """Encode rows as newline delimited json, yielding bytes every
+    `chunk_size` rows"""
+    if chunk_size is None:
+        chunk_size = get_config("CHUNK_SIZE")
+    chunk = []
+
+    for record in _iter_records(data, header):
+        chunk.append(json_dumps(record))
+        if len(chunk) >= chunk_size:
+            yield b"\n".join(chunk) + b"\n"
+            chunk = []
+
+    if chunk:
+        yield b"\n".join(chunk) + b"\n"
+
+
+def iter_to_json_response(data, title="report", header=None):
+    """Make an iterable of rows into a streaming json response for download.
+    Rows are dicts keyed by header if given, lists otherwise."""
+    response = StreamingHttpResponse(
+        iter_json(data, header), content_type="application/json"
+    )
+    response["Content-Disposition"] = 'attachment; filename="%s.json"' % title
+    return response
+
+
+def iter_to_ndjson_response(data, title="report", header=None):
+    """Make an iterable of rows into a streaming ndjson response for
+    download, one json record per line."""
+    response = StreamingHttpResponse(
+        iter_ndjson(data, header), content_type="application/x-ndjson"
+    )
+    response["Content-Disposition"] = 'attachment; filename="%s.ndjson"' % title
+    return response
+
+
+def list_to_html_response(
+    data, title="", header=None, page=None, params=None, request=None
+):
+    """Make 2D list into a html table response.
+    If page is given, a pager is rendered too, its links re-submit params
+    (a list of name, value pairs) along with the requested page.
+    """
+    html = render_to_string(
+        "export_action/report_html.html",
+        {
+            "data": data,
+            "title": title,
+            "header": header,
+            "page": page,
+            "params": params or [],
+        },
+        request=request,
+    )
     return HttpResponse(html)
+
+
+def iter_html(data, title="", header=None, chunk_size=None):
+    """Render rows as a html table, yielding a string every `chunk_size`
+    rows"""
+    if chunk_size is None:
+        chunk_size = get_config("CHUNK_SIZE")
+    context = {"title": title, "header": header}
+
+    yield render_to_string("export_action/report_html_start.html", context)
+    chunk = []
+    for row in data:
+        chunk.append(
+            "<tr>%s</tr>\n"
+            % "".join("<td>%s</td>" % linebreaksbr(cell, autoescape=True) for cell in row)
+        )
+        if len(chunk) >= chunk_size:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+    yield render_to_string("export_action/report_html_end.html", context)
+
+
+def iter_to_html_response(data, title="", header=None):
+    """Make an iterable of rows into a streaming html table response"""
+    return StreamingHttpResponse(iter_html(data, title, header))
+
+
+def close_response(response):
+    """Release the resources of a response which is not returned to the
+    request handler (temporary files...). Unlike response.close() it does
+    not send request_finished, which closes the database connections."""
+    # The same as HttpResponseBase.close() but the signal. The resources
+    # are registered in the private _resource_closers list since Django
+    # 3.0 (_closable_objects before), up to Django 5.2 at least; this is
+    # the only place relying on it.
+    for closer in response._resource_closers:
+        try:
+            closer()
+        except Exception:
+            pass
+    response._resource_closers.clear()
+    response.closed = True
+
+
+def _iter_response_content(response):
+    try:
+        if response.streaming:
+            for chunk in response.streaming_content:
+                yield chunk
+        else:
+            yield response.content
+    finally:
+        close_response(response)
+
+
+def iter_gzip(chunks):
+    """Gzip a stream of bytes chunk by chunk"""
+    # the level of the zlib default and of zip archives, 9 costs several
+    # times the cpu of 6 for a few percent smaller files
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class _ZipBuffer(object):
+    """Unseekable file object collecting what zipfile writes, so that the
+    archive can be sent while it is written"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_zip(chunks, filename):
+    """Zip a stream of bytes chunk by chunk, as the single `filename` entry
+    of the archive"""
+    buffer = _ZipBuffer()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        with archive.open(filename, "w", force_zip64=True) as entry:
+            for chunk in chunks:
+                entry.write(chunk)
+                data = buffer.pop()
+                if data:
+                    yield data
+    yield buffer.pop()
+
+
+def _get_response_filename(response, default="report"):
+    match = re.search(
+        r'filename="?([^";]+)"?', response.get("Content-Disposition", "")
+    )
+    return match.group(1) if match else default
+
+
+def compress_response(response, method, accept_encoding="", filename=None):
+    """Compress the content of response while it is sent.
+    With `gzip`, if the client accepts the gzip content encoding the
+    response is sent gzip encoded and saved uncompressed by the browser,
+    otherwise a .gz file is sent. With `zip` a zip archive is sent.
+    filename defaults to the one of the Content-Disposition of response."""
+    filename = filename or _get_response_filename(response)
+    content = _iter_response_content(response)
+
+    if method == "gzip":
+        compressed = StreamingHttpResponse(
+            iter_gzip(content), content_type=response["Content-Type"]
+        )
+        if re.search(r"\bgzip\b", accept_encoding or ""):
+            compressed["Content-Encoding"] = "gzip"
+            compressed["Vary"] = "Accept-Encoding"
+            if response.has_header("Content-Disposition"):
+                compressed["Content-Disposition"] = response["Content-Disposition"]
+        else:
+            compressed["Content-Type"] = "application/gzip"
+            compressed["Content-Disposition"] = (
+                'attachment; filename="%s.gz"' % filename
+            )
+    elif method == "zip":
+        compressed = StreamingHttpResponse(
+            iter_zip(content, filename), content_type="application/zip"
+        )
+        compressed["Content-Disposition"] = 'attachment; filename="%s.zip"' % (
+            filename.rsplit(".", 1)[0]
+        )
+    else:
+        raise ValueError("Unknown compression %r" % method)
+    return compressed
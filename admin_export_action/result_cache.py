@@ -0,0 +1,185 @@
+# coding: utf-8
+"""Cache of export results.
+
+Exported files are stored in a Django cache, keyed by everything which
+can change their content (selection, fields, flags, format, user and
+language) and by the version of every model whose data end up in the
+export, including the intermediate models of the many-to-many relations
+they follow. Saving or deleting an instance of a model, or changing the
+many-to-many relations it is the intermediate model of, increments its
+version, so the exports built from it are never read again and expire. Every entry
+is smaller than RESULT_CACHE_MAX_SIZE bytes, bounding the total size is
+left to the cache (MAX_ENTRIES, maxmemory...).
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import hashlib
+import time
+
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.core.exceptions import EmptyResultSet
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.http import HttpResponse
+from django.utils.translation import get_language
+
+from . import report
+from .config import get_config
+
+VERSION_KEY = "admin_export_action:v:%s"
+CACHED_HEADERS = ("Content-Type", "Content-Disposition")
+
+
+def get_cache():
+    return caches[get_config("RESULT_CACHE_ALIAS")]
+
+
+def get_export_models(model_class, fields):
+    """Return the labels of the models whose data end up in the export"""
+    models = {model_class._meta.label}
+    for column in report.get_column_plan(model_class, fields):
+        for field in column.fields:
+            models.add(field.model._meta.label)
+            if field.related_model:
+                models.add(field.related_model._meta.label)
+            if field.many_to_many:
+                # the relation itself is stored in the intermediate model
+                rel = field if field.auto_created else field.remote_field
+                models.add(rel.through._meta.label)
+    return models
+
+
+def get_model_versions(labels):
+    """Return the current versions of the models labels, as a sorted list
+    of (label, version)"""
+    cache = get_cache()
+    keys = {VERSION_KEY % label: label for label in labels}
+    versions = cache.get_many(keys)
+    for key in set(keys) - set(versions):
+        # a new, or evicted, version starts from the current time, so that
+        # it never matches the version of an entry built before
+        cache.add(key, int(time.time() * 1000), None)
+        versions[key] = cache.get(key)
+    return sorted((keys[key], version) for key, version in versions.items())
+
+
+def get_cache_key(queryset, fields, user, include_header, format,
+                  raw_choices=False, aggregate_many=False):
+    try:
+        sql, params = queryset.query.sql_with_params()
+        selection = "%s %r" % (sql, params)
+    except EmptyResultSet:
+        selection = ""
+    parts = (
+        ContentType.objects.get_for_model(queryset.model).pk,
+        hashlib.sha256(selection.encode("utf-8")).hexdigest(),
+        tuple(fields),
+        bool(raw_choices),
+        bool(aggregate_many),
+        bool(include_header),
+        format,
+        user.pk,
+        get_language(),
+        get_model_versions(get_export_models(queryset.model, fields)),
+    )
+    return "admin_export_action:%s" % hashlib.sha256(
+        repr(parts).encode("utf-8")).hexdigest()
+
+
+def get_response(key):
+    """Return the cached response for key, None if not cached"""
+    value = get_cache().get(key)
+    if value is None:
+        return None
+    headers, content = value
+
+    response = HttpResponse(content)
+    for name, header_value in headers.items():
+        response[name] = header_value
+    return response
+
+
+def _store(key, headers, content):
+    get_cache().set(key, (headers, content),
+                    get_config("RESULT_CACHE_TIMEOUT"))
+
+
+def cache_response(key, response):
+    """Store the content of response once it has been generated.
+    Responses larger than RESULT_CACHE_MAX_SIZE are not cached, streaming
+    responses are cached while they are sent."""
+    max_size = get_config("RESULT_CACHE_MAX_SIZE")
+    headers = {
+        name: response[name] for name in CACHED_HEADERS if name in response
+    }
+
+    if not response.streaming:
+        if len(response.content) <= max_size:
+            _store(key, headers, response.content)
+        return response
+
+    streaming_content = response.streaming_content
+
+    def content():
+        chunks = []
+        size = 0
+        for chunk in streaming_content:
+            if chunks is not None:
+                size += len(chunk)
+                if size > max_size:
+                    chunks = None
+                else:
+                    chunks.append(chunk)
+            yield chunk
+        if chunks is not None:
+            _store(key, headers, b"".join(chunks))
+
+    response.streaming_content = content()
+    return response
+
+
+def invalidate_model(sender, **kwargs):
+    """post_save and post_delete receiver: increment the version of the
+    sender model, the cached exports which contain its data are not read
+    anymore"""
+    try:
+        get_cache().incr(VERSION_KEY % sender._meta.label)
+    except ValueError:
+        pass  # no export of the model was cached
+
+
+def invalidate_through_model(sender, action, **kwargs):
+    """m2m_changed receiver: increment the version of the intermediate
+    model once the relations have changed"""
+    if action.startswith("post_"):
+        invalidate_model(sender)
+
+
+SIGNALS = (
+    (post_save, invalidate_model, "admin_export_action_post_save"),
+    (post_delete, invalidate_model, "admin_export_action_post_delete"),
+    (m2m_changed, invalidate_through_model, "admin_export_action_m2m_changed"),
+)
+
+
+def _get_invalidated_models():
+    ignored = set(get_config("RESULT_CACHE_IGNORE_MODELS"))
+    return [
+        model for model in apps.get_models(include_auto_created=True)
+        if model._meta.label not in ignored
+    ]
+
+
+def connect_signals():
+    """Invalidate the cached exports of every model when it changes"""
+    for model in _get_invalidated_models():
+        for signal, receiver, dispatch_uid in SIGNALS:
+            signal.connect(receiver, sender=model, dispatch_uid=dispatch_uid)
+
+
+def disconnect_signals():
+    for model in _get_invalidated_models():
+        for signal, receiver, dispatch_uid in SIGNALS:
+            signal.disconnect(sender=model, dispatch_uid=dispatch_uid)
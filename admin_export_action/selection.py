@@ -0,0 +1,94 @@
+# coding: utf-8
+"""The objects to export.
+
+The export action passes the objects selected in the admin changelist by
+id, in the query string or, for large selections, in the session, or the
+filters of the changelist when all its results are selected and
+EXPORT_BY_FILTERS is set. A selection is a JSON serializable dict, so
+background exports store it and rebuild the queryset when they run.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import copy
+import importlib
+import json
+
+from django.conf import settings
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.core.exceptions import BadRequest
+from django.http import HttpRequest, QueryDict
+
+from . import report
+
+if hasattr(settings,
+           'ADMIN_EXPORT_ACTION') and settings.ADMIN_EXPORT_ACTION.get(
+               'ADMIN_SITE_PATH', None) is not None:
+    admin = importlib.import_module(
+        settings.ADMIN_EXPORT_ACTION.get('ADMIN_SITE_PATH'))
+else:
+    from django.contrib import admin
+
+
+def get_model_admin(model_class):
+    try:
+        return admin.site._registry[model_class]
+    except KeyError:
+        raise ValueError("Model %r not registered with admin" % model_class)
+
+
+def get_selection(request):
+    """ Return the selection passed to the export view """
+    if "changelist_filters" in request.GET:
+        return {"changelist_filters": request.GET["changelist_filters"]}
+
+    if request.GET.get("session_key"):
+        ids = request.session[request.GET["session_key"]]
+        if type(ids) == str:
+            ids = json.loads(ids)
+    else:
+        ids = request.GET['ids'].split(',')
+    return {"ids": list(ids)}
+
+
+def get_queryset(request, model_class, selection):
+    """ Return the queryset of the selected objects of model_class that
+    request.user may see """
+    model_admin = get_model_admin(model_class)
+    if "changelist_filters" in selection:
+        return get_changelist_queryset(request, model_admin,
+                                       selection["changelist_filters"])
+    return report.filter_by_pks(model_admin.get_queryset(request),
+                                selection["ids"])
+
+
+def get_changelist_queryset(request, model_admin, changelist_filters):
+    """ Rebuild the queryset of the admin changelist, filtered and
+    ordered as it was when the export action was run """
+    request = copy.copy(request)
+    request.GET = QueryDict(changelist_filters)
+    ChangeList = model_admin.get_changelist(request)
+
+    class ExportChangeList(ChangeList):
+        def get_results(self, request):
+            # the changelist page counts and slices the results, the
+            # export needs the queryset only
+            pass
+
+    # get_changelist_instance passes the arguments of the ChangeList
+    # of the running Django version
+    model_admin = copy.copy(model_admin)
+    model_admin.get_changelist = lambda request, **kwargs: ExportChangeList
+    try:
+        return model_admin.get_changelist_instance(request).queryset
+    except IncorrectLookupParameters:
+        raise BadRequest("Invalid changelist filters")
+
+
+def get_user_request(user):
+    """ A request of user, to rebuild a selection outside of the request
+    which made it """
+    request = HttpRequest()
+    request.method = 'GET'
+    request.user = user
+    return request
@@ -0,0 +1,6 @@
+# coding: utf-8
+from django.dispatch import Signal
+
+# Sent when an export is finished, with the model class as sender and the
+# ExportTimings of the export as `timings`
+export_finished = Signal()
@@ -0,0 +1,59 @@
+# coding: utf-8
+"""Storage of the files of background exports.
+
+Exported files hold data only their owner may see, they are downloaded
+through the export_job_download view, so they must not be saved in a
+storage served to anyone, like the media one. ASYNC_STORAGE is the alias
+of a storage of settings.STORAGES (Django 4.2+), by default files are
+saved in a private folder of the temporary directory.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import os
+import tempfile
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import FileSystemStorage
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.functional import LazyObject, empty
+
+from .config import get_config
+
+try:
+    from django.core.files.storage import storages
+except ImportError:  # Django < 4.2
+    storages = None
+
+
+class ExportStorage(LazyObject):
+
+    def _setup(self):
+        alias = get_config('ASYNC_STORAGE')
+        if alias is None:
+            self._wrapped = FileSystemStorage(
+                location=os.path.join(tempfile.gettempdir(),
+                                      'admin_export_action'),
+                directory_permissions_mode=0o700,
+                file_permissions_mode=0o600,
+            )
+        elif storages is None:
+            raise ImproperlyConfigured(
+                'ASYNC_STORAGE requires the STORAGES setting of Django 4.2+')
+        else:
+            self._wrapped = storages[alias]
+
+
+export_storage = ExportStorage()
+
+
+def get_export_storage():
+    """ Storage of ExportJob.file """
+    return export_storage
+
+
+@receiver(setting_changed)
+def reset_export_storage(setting, **kwargs):
+    if setting in ('ADMIN_EXPORT_ACTION', 'STORAGES'):
+        export_storage._wrapped = empty
@@ -1,6 +1,6 @@
-from django.urls import re_path
+from django.urls import path, re_path
 from django.contrib.admin.views.decorators import staff_member_required
-from .views import AdminExport
+from .views import AdminExport, AdminExportJob, export_job_download
 
 view = staff_member_required(AdminExport.as_view())
 
@@ -8,4 +8,10 @@ app_name = 'admin_export_action'
 
 urlpatterns = [
     re_path(r'^export/$', view, name="export"),
+    path('export/job/<uuid:pk>/',
+         staff_member_required(AdminExportJob.as_view()),
+         name="job"),
+    path('export/job/<uuid:pk>/download/',
+         staff_member_required(export_job_download),
+         name="job_download"),
 ]
@@ -2,100 +2,254 @@
 
 from __future__ import absolute_import, unicode_literals
 
-import importlib
-import json
+import os
 
-from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.http import FileResponse, HttpResponseRedirect
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils import timezone
 from django.views.generic import TemplateView
 
-from . import introspection, report
+from . import (admission, instrumentation, introspection, jobs, report,
+               result_cache, selection)
+from .config import get_config
+from .models import ExportJob
+from .selection import admin
 
-if hasattr(settings,
-           'ADMIN_EXPORT_ACTION') and settings.ADMIN_EXPORT_ACTION.get(
-               'ADMIN_SITE_PATH', None) is not None:
-    admin = importlib.import_module(
-        settings.ADMIN_EXPORT_ACTION.get('ADMIN_SITE_PATH'))
-else:
-    from django.contrib import admin
+COMPRESSIONS = ("gzip", "zip")
+# xlsx, parquet and arrow files are compressed already
+COMPRESSED_FORMATS = ("csv", "json", "ndjson", "html")
 
 
 class AdminExport(TemplateView):
     """ Get fields from a particular model """
     template_name = 'export_action/export.html'
 
-    def get_queryset(self, model_class):
-        if self.request.GET.get("session_key"):
-            ids = self.request.session[self.request.GET["session_key"]]
-            if type(ids) == str:
-                ids = json.loads(ids)
-        else:
-            ids = self.request.GET['ids'].split(',')
-        try:
-            model_admin = admin.site._registry[model_class]
-        except KeyError:
-            raise ValueError("Model %r not registered with admin" %
-                             model_class)
-        queryset = model_admin.get_queryset(self.request).filter(pk__in=ids)
-        return queryset
+    def get_queryset(self, model_class, export_selection):
+        return selection.get_queryset(self.request, model_class,
+                                      export_selection)
 
     def get_model_class(self):
-        model_class = ContentType.objects.get(
-            id=self.request.GET['ct']).model_class()
+        model_class = ContentType.objects.get_for_id(
+            int(self.request.GET['ct'])).model_class()
         return model_class
 
     def get_context_data(self, **kwargs):
         context = super(AdminExport, self).get_context_data(**kwargs)
         field_name = self.request.GET.get('field', '')
         model_class = self.get_model_class()
-        queryset = self.get_queryset(model_class)
+        export_selection = selection.get_selection(self.request)
+        queryset = self.get_queryset(model_class, export_selection)
         path = self.request.GET.get('path', '')
         context['opts'] = model_class._meta
+        context['selection'] = export_selection
         context['queryset'] = queryset
         context['model_ct'] = self.request.GET['ct']
+        context['arrow_available'] = report.pyarrow is not None
 
-        related = introspection.get_relation_fields_from_model(model_class)
-        context['related_fields'] = sorted(related, key=lambda x: x.verbose_name if hasattr(x, 'verbose_name') else x.get_accessor_name())
+        context['related_fields'] = introspection.get_model_fields(
+            model_class).relations
 
         # extra context
-        try:
-            model_admin = admin.site._registry[model_class]
-        except KeyError:
-            raise ValueError("Model %r not registered with admin" %
-                             model_class)
-
+        model_admin = selection.get_model_admin(model_class)
         context.update(model_admin.admin_site.each_context(self.request))
 
         struct = introspection.get_fields(model_class, field_name, path)
         context.update({
-            "fields": sorted(struct.get("fields"), key=lambda x: x.verbose_name if hasattr(x, 'verbose_name') else x.name),
+            "fields": struct.get("fields"),
         })
         return context
 
     def post(self, request, **kwargs):
         context = self.get_context_data(**kwargs)
+        queryset = context['queryset']
         fields = []
         for field_name, value in request.POST.items():
             if value == "on":
                 fields.append(field_name)
 
-        raw_choices = request.POST.get("__raw_choices", 0)
-        data_list, message = report.report_to_list(
-            context['queryset'],
-            fields,
-            self.request.user,
-            bool(int(raw_choices)),
-        )
+        options = {
+            'raw_choices': bool(int(request.POST.get("__raw_choices", 0))),
+            'aggregate_many': bool(
+                int(request.POST.get("__aggregate_many", 0))),
+        }
         format = request.POST.get("__format")
         include_header = request.POST.get("__include_header", None)
         header = [
-            report.get_field_verbose_name(context['queryset'], field)
+            report.get_field_verbose_name(queryset, field)
             for field in fields
         ] if include_header is not None and int(
             request.POST.get("__include_header")) else None
+
+        if get_config('ASYNC_EXPORT') and format != "html":
+            job = jobs.create_export_job(
+                queryset.model,
+                context['selection'],
+                fields,
+                self.request.user,
+                format=format or "xlsx",
+                include_header=header is not None,
+                **options
+            )
+            return HttpResponseRedirect(
+                reverse('admin_export_action:job', args=[job.pk]))
+
+        slot = admission.acquire(request.user, queryset)
+        if slot is None:
+            return admission.too_many_exports_response()
+
+        timings = instrumentation.ExportTimings(queryset.model, format,
+                                                request.user)
+        try:
+            with timings.activate(), instrumentation.phase("write"):
+                response = self.get_response(queryset, fields, options,
+                                             format, header)
+        except BaseException:
+            slot.release()
+            raise
+        response = instrumentation.instrument_response(response, timings)
+        return admission.release_on_close(response, slot)
+
+    def get_response(self, queryset, fields, options, format, header):
+        compress = self.request.POST.get("__compress")
+        if compress not in COMPRESSIONS or format not in COMPRESSED_FORMATS:
+            compress = None
+
         if format == "html":
-            return report.list_to_html_response(data_list, header=header)
-        elif format == "csv":
+            response = self.get_html_response(queryset, fields, options,
+                                              header)
+            # the paged preview is rendered in the browser as it is
+            if compress and (self.request.POST.get("__page") == "all"
+                             or not get_config('HTML_PAGE_SIZE')):
+                response = self.compress_response(response, compress,
+                                                  "report.html")
+            return response
+
+        cache_key = None
+        response = None
+        if get_config('RESULT_CACHE'):
+            cache_key = result_cache.get_cache_key(queryset,
+                                                   fields,
+                                                   self.request.user,
+                                                   header is not None,
+                                                   format,
+                                                   **options)
+            response = result_cache.get_response(cache_key)
+
+        if response is None:
+            response = self.get_export_response(queryset,
+                                                fields,
+                                                options,
+                                                format,
+                                                header,
+                                                streaming=compress is not None)
+            if cache_key is not None:
+                response = result_cache.cache_response(cache_key, response)
+        if compress:
+            response = self.compress_response(response, compress)
+        return response
+
+    def compress_response(self, response, compress, filename=None):
+        return report.compress_response(
+            response,
+            compress,
+            self.request.META.get('HTTP_ACCEPT_ENCODING', ''),
+            filename=filename)
+
+    def get_html_response(self, queryset, fields, options, header):
+        if self.request.POST.get("__page") == "all":
+            rows, message = report.report_to_iterator(
+                queryset,
+                fields,
+                self.request.user,
+                **options
+            )
+            return report.iter_to_html_response(rows, header=header)
+        elif get_config('HTML_PAGE_SIZE'):
+            page, data_list, message = report.report_to_page(
+                queryset,
+                fields,
+                self.request.user,
+                page_number=self.request.POST.get("__page", 1),
+                **options
+            )
+            params = [(name, value)
+                      for name, values in self.request.POST.lists()
+                      for value in values
+                      if name not in ("csrfmiddlewaretoken", "__page")]
+            return report.list_to_html_response(data_list,
+                                                header=header,
+                                                page=page,
+                                                params=params,
+                                                request=self.request)
+
+        data_list, message = report.report_to_list(
+            queryset,
+            fields,
+            self.request.user,
+            **options
+        )
+        return report.list_to_html_response(data_list, header=header)
+
+    def get_export_response(self,
+                            queryset,
+                            fields,
+                            options,
+                            format,
+                            header,
+                            streaming=False):
+        if format == "csv" and get_config('POSTGRES_COPY'):
+            chunks, message = report.report_to_copy_csv(queryset,
+                                                        fields,
+                                                        self.request.user,
+                                                        header=header,
+                                                        **options)
+            return report.csv_chunks_to_response(chunks)
+
+        if format == "sheets":
+            sheets, headers, message = report.report_to_sheets(
+                queryset,
+                fields,
+                self.request.user,
+                raw_choices=options['raw_choices'])
+            return report.list_to_xlsx_response(
+                sheets, header=headers if header is not None else None)
+        elif format in ("parquet", "arrow") and report.pyarrow is not None:
+            schema, batches, message = report.report_to_arrow(
+                queryset,
+                fields,
+                self.request.user,
+                verbose_names=header is not None,
+                **options
+            )
+            if format == "parquet":
+                return report.arrow_to_parquet_response(schema, batches)
+            else:
+                return report.arrow_to_ipc_response(schema, batches)
+        elif format == "ndjson" or streaming or get_config('STREAMING'):
+            rows, message = report.report_to_iterator(
+                queryset,
+                fields,
+                self.request.user,
+                **options
+            )
+            if format == "csv":
+                return report.iter_to_csv_response(rows, header=header)
+            elif format == "json":
+                return report.iter_to_json_response(rows, header=header)
+            elif format == "ndjson":
+                return report.iter_to_ndjson_response(rows, header=header)
+            else:
+                return report.iter_to_xlsx_response(rows, header=header)
+
+        data_list, message = report.report_to_list(
+            queryset,
+            fields,
+            self.request.user,
+            **options
+        )
+        if format == "csv":
             return report.list_to_csv_response(data_list, header=header)
         elif format == "json":
             return report.list_to_json_response(data_list, header=header)
@@ -115,8 +269,8 @@ class AdminExportRelated(TemplateView):
 
     def get(self, request, **kwargs):
         context = self.get_context_data(**kwargs)
-        model_class = ContentType.objects.get(
-            id=self.request.GET['model_ct']).model_class()
+        model_class = ContentType.objects.get_for_id(
+            int(self.request.GET['model_ct'])).model_class()
         field_name = request.GET['field']
         path = request.GET['path']
         field_data = introspection.get_fields(model_class, field_name, path)
@@ -128,3 +282,32 @@ class AdminExportRelated(TemplateView):
         context['table'] = True
         context.update(field_data)
         return self.render_to_response(context)
+
+
+class AdminExportJob(TemplateView):
+    """ Status page of a background export """
+    template_name = 'export_action/job.html'
+
+    def get_context_data(self, **kwargs):
+        context = super(AdminExportJob, self).get_context_data(**kwargs)
+        job = get_object_or_404(ExportJob,
+                                pk=kwargs['pk'],
+                                user=self.request.user)
+        context['job'] = job
+        context['opts'] = ContentType.objects.get_for_id(
+            job.content_type_id).model_class()._meta
+        context.update(admin.site.each_context(self.request))
+        return context
+
+
+def export_job_download(request, pk):
+    job = get_object_or_404(ExportJob,
+                            pk=pk,
+                            user=request.user,
+                            status=ExportJob.STATUS_DONE)
+    return FileResponse(job.file.open('rb'),
+                        as_attachment=True,
+                        filename='report_{0}{1}'.format(
+                            timezone.localtime(
+                                job.created_on).strftime('%Y-%m-%d_%H%M'),
+                            os.path.splitext(job.file.name)[1]))
@@ -12,7 +12,12 @@ REPO_URL = "http://github.com/otto-torino/django-admin-export-action"
 setup(
     name="django-admin-export-action",
     version="0.3.3",
-    packages=["admin_export_action"],
+    packages=[
+        "admin_export_action",
+        "admin_export_action.management",
+        "admin_export_action.management.commands",
+        "admin_export_action.migrations",
+    ],
     include_package_data=True,
     license="MIT License",
     description="Export action for django admin",
@@ -1,19 +1,36 @@
 # -- encoding: UTF-8 --
+import gzip
+import io
 import json
+import os
+import tempfile
+import threading
 import uuid
+import zipfile
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from unittest import mock, skipIf
 
-from admin_export_action import report
+from admin_export_action import admission, introspection, report, result_cache
 from admin_export_action.admin import export_selected_objects
 from admin_export_action.config import default_config, get_config
+from admin_export_action.models import ExportJob
+from admin_export_action.signals import export_finished
 
+from django.conf import settings
 from django.contrib.admin.sites import AdminSite
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
-from django.test import TestCase, RequestFactory
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.translation import gettext_lazy
 from django.utils.http import urlencode
-from news.models import News, NewsTag
+from news.models import Category, News, NewsTag, Tag
 from news.admin import NewsAdmin
+from openpyxl import load_workbook
 
 
 class FakeDict(object):
@@ -273,7 +290,7 @@ class AdminExportActionTest(TestCase):
             self.client.login(username='admin', password='admin')
             response = self.client.post(url, data=data)
             assert response.status_code == 200
-            assert response.content
+            assert response.getvalue()
 
     def test_build_sheet_convert_function(self):
         data = [
@@ -284,3 +301,825 @@ class AdminExportActionTest(TestCase):
 
         report.build_sheet(data, ws, sheet_name='report', header=None, widths=None)
         self.assertEqual(ws.rows, [['1', 5, 'converted', 9, "{'foo': 'bar'}", '[1, 2]', '12345678-1234-5678-1234-567812345678']])
+
+    def test_iter_to_csv_response_should_stream_expected_content(self):
+        admin = User.objects.get(pk=1)
+        rows, messages = report.report_to_iterator(News.objects.all(),
+                                                   ['id', 'title', 'status'],
+                                                   admin, chunk_size=1)
+        res = report.iter_to_csv_response(rows, header=['id', 'title', 'status'])
+
+        assert res.status_code == 200
+        assert res.streaming
+        assert b''.join(res.streaming_content) == (
+            b'id,title,status\r\n1,Lucio Dalla,published\r\n2,La mano de Dios,draft\r\n')
+
+    def test_iter_csv_should_yield_chunks(self):
+        chunks = list(report.iter_csv([[1], [2], [3]], header=['id'], chunk_size=2))
+        self.assertEqual(chunks, ['id\r\n1\r\n', '2\r\n3\r\n'])
+
+    def test_admin_export_post_streaming_csv(self):
+        params = {
+            'ct': ContentType.objects.get_for_model(News).pk,
+            'ids': ','.join(
+                repr(pk) for pk in News.objects.values_list('pk', flat=True))
+        }
+        data = {
+            "id": "on",
+            "title": "on",
+            "__format": "csv",
+            "__include_header": "0",
+        }
+        url = "{}?{}".format(reverse('admin_export_action:export'),
+                             urlencode(params))
+        self.client.login(username='admin', password='admin')
+        with self.settings(ADMIN_EXPORT_ACTION={'STREAMING': True}):
+            response = self.client.post(url, data=data)
+        assert response.status_code == 200
+        assert response.streaming
+        assert b''.join(response.streaming_content) == b'1,Lucio Dalla\r\n2,La mano de Dios\r\n'
+
+    def test_iter_to_workbook_should_write_rows_and_bold_header(self):
+        admin = User.objects.get(pk=1)
+        rows, messages = report.report_to_iterator(News.objects.all(),
+                                                   ['id', 'title', 'status'],
+                                                   admin)
+        wb = report.iter_to_workbook(rows, header=['id', 'title', 'status'], widths=[5, 30, 10])
+        out = io.BytesIO()
+        wb.save(out)
+
+        ws = load_workbook(out).worksheets[0]
+        self.assertEqual(ws.title, 'report')
+        self.assertEqual([[c.value for c in row] for row in ws.iter_rows()], [
+            ['id', 'title', 'status'],
+            [1, 'Lucio Dalla', 'published'],
+            [2, 'La mano de Dios', 'draft'],
+        ])
+        self.assertTrue(ws['A1'].font.bold)
+        self.assertFalse(ws['A2'].font.bold)
+        self.assertEqual(ws.column_dimensions['B'].width, 30)
+
+    def test_list_to_xlsx_response_should_stream_file(self):
+        res = report.list_to_xlsx_response([[1, 'Lucio Dalla']], header=['id', 'title'])
+
+        assert res.status_code == 200
+        assert res.streaming
+        assert res['Content-Disposition'].startswith('attachment; filename="report_')
+        content = b''.join(res.streaming_content)
+        self.assertEqual(int(res['Content-Length']), len(content))
+        ws = load_workbook(io.BytesIO(content)).worksheets[0]
+        self.assertEqual(ws['B2'].value, 'Lucio Dalla')
+
+    def test_get_column_plan_should_resolve_paths_once(self):
+        columns = report.get_column_plan(News, ['title', 'status', 'tags__type'])
+
+        self.assertEqual([c.verbose_name for c in columns],
+                         ['main title', 'status', 'all tags type'])
+        self.assertEqual([c.model for c in columns], [News, News, Tag])
+        self.assertIsNone(columns[0].converter)
+        self.assertEqual(columns[1].converter(News.PUBLISHED), 'published')
+        self.assertEqual(columns[2].converter(Tag.TYPE_SPECIFIC), 'specific')
+        self.assertIsNone(columns[1].converter(None))
+
+        raw_columns = report.get_column_plan(News, ['title', 'status'], raw_choices=True)
+        self.assertEqual([c.converter for c in raw_columns], [None, None])
+
+        self.assertEqual(report.get_field_display_value(News.objects, 'status', News.DRAFT), 'draft')
+
+    def test_build_sheet_type_converters(self):
+        data = [
+            [datetime(2020, 1, 1, 10, tzinfo=timezone.utc), gettext_lazy('Export'),
+             Decimal('1.5'), Decimal('NaN')],
+        ]
+        ws = WS()
+        report.build_sheet(data, ws)
+        self.assertEqual(ws.rows, [[datetime(2020, 1, 1, 10), 'Export', Decimal('1.5'), 'NaN']])
+
+    def test_register_cell_converter(self):
+        class Point(tuple):
+            pass
+
+        self.assertIsNone(report.get_cell_converter(Point))
+        report.register_cell_converter(tuple, lambda value: ','.join(str(v) for v in value))
+        try:
+            self.assertEqual(report.get_cell_converter(Point)(Point((1, 2))), '1,2')
+        finally:
+            report.register_cell_converter(tuple, None)
+        self.assertIsNone(report.get_cell_converter(Point))
+
+    def test_iter_to_json_response_should_stream_expected_content(self):
+        admin = User.objects.get(pk=1)
+        rows, messages = report.report_to_iterator(News.objects.all(),
+                                                   ['id', 'title', 'status'],
+                                                   admin)
+        res = report.iter_to_json_response(rows, header=['id', 'title', 'status'])
+        assert res.status_code == 200
+        d = json.loads(b''.join(res.streaming_content))
+        self.assertEqual(d, [
+            {'id': 1, 'title': 'Lucio Dalla', 'status': 'published'},
+            {'id': 2, 'title': 'La mano de Dios', 'status': 'draft'},
+        ])
+
+        chunks = list(report.iter_json([[1], [2], [3]], chunk_size=2))
+        self.assertEqual(chunks, [b'[[1],[2]', b',[3]', b']'])
+        self.assertEqual(json.loads(b''.join(report.iter_json([]))), [])
+
+    def test_iter_to_ndjson_response_should_stream_expected_content(self):
+        data = [[1, Decimal('1.50'), datetime(2020, 1, 1, 10, tzinfo=timezone.utc)]]
+        res = report.iter_to_ndjson_response(iter(data), header=['id', 'price', 'date'])
+        assert res.status_code == 200
+        assert res['Content-Type'] == 'application/x-ndjson'
+        lines = b''.join(res.streaming_content).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'id': 1, 'price': '1.50', 'date': '2020-01-01T10:00:00Z'},
+        ])
+        # the same compact output with or without orjson
+        self.assertEqual(report.json_dumps({'id': 1, 'title': 'Città', 'date': data[0][2]}),
+                         '{"id":1,"title":"Città","date":"2020-01-01T10:00:00Z"}'.encode('utf-8'))
+
+    def test_admin_export_post_ndjson(self):
+        params = {
+            'ct': ContentType.objects.get_for_model(News).pk,
+            'ids': ','.join(
+                repr(pk) for pk in News.objects.values_list('pk', flat=True))
+        }
+        data = {
+            "title": "on",
+            "__format": "ndjson",
+            "__include_header": "1",
+        }
+        url = "{}?{}".format(reverse('admin_export_action:export'),
+                             urlencode(params))
+        self.client.login(username='admin', password='admin')
+        response = self.client.post(url, data=data)
+        assert response.status_code == 200
+        lines = response.getvalue().splitlines()
+        self.assertEqual(json.loads(lines[0]), {'main title': 'Lucio Dalla'})
+
+    def test_admin_export_post_html_should_be_paginated(self):
+        params = {
+            'ct': ContentType.objects.get_for_model(News).pk,
+            'ids': ','.join(
+                repr(pk) for pk in News.objects.values_list('pk', flat=True))
+        }
+        data = {
+            "title": "on",
+            "__format": "html",
+        }
+        url = "{}?{}".format(reverse('admin_export_action:export'),
+                             urlencode(params))
+        self.client.login(username='admin', password='admin')
+        with self.settings(ADMIN_EXPORT_ACTION={'HTML_PAGE_SIZE': 1}):
+            response = self.client.post(url, data=data)
+            content = response.content.decode()
+            assert response.status_code == 200
+            assert 'Lucio Dalla' in content
+            assert 'La mano de Dios' not in content
+            assert 'name="__page" value="2"' in content
+            assert '<input type="hidden" name="title" value="on"/>' in content
+
+            response = self.client.post(url, data=dict(data, __page=2))
+            content = response.content.decode()
+            assert 'Lucio Dalla' not in content
+            assert 'La mano de Dios' in content
+            assert 'name="__page" value="1"' in content
+
+            response = self.client.post(url, data=dict(data, __page='all'))
+            assert response.streaming
+            content = response.getvalue().decode()
+            assert 'Lucio Dalla' in content
+            assert 'La mano de Dios' in content
+            assert 'name="__page"' not in content
+
+    def test_iter_html_should_escape_cells(self):
+        html = ''.join(report.iter_html([['<b>a\nb</b>']], header=['x'], chunk_size=1))
+        assert '<th>x</th>' in html
+        assert '<td>&lt;b&gt;a<br>b&lt;/b&gt;</td>' in html
+
+    def test_admin_action_select_across_should_export_by_filters(self):
+        data = {
+            "action": "export_selected_objects",
+            "_selected_action": [repr(News.objects.get(status=News.PUBLISHED).pk)],
+            "select_across": "1",
+            "index": "0",
+        }
+        url = "{}?{}".format(reverse('admin:news_news_changelist'),
+                             urlencode({'status__exact': News.PUBLISHED}))
+        self.client.login(username='admin', password='admin')
+        response = self.client.post(url, data=data)
+
+        assert response.status_code == 302
+        expected_url = "{}?{}".format(
+            reverse('admin_export_action:export'),
+            urlencode({
+                'ct': ContentType.objects.get_for_model(News).pk,
+                'changelist_filters': 'status__exact=2',
+            }))
+        assert response.url.endswith(expected_url)
+        assert 'ids=' not in response.url
+        assert 'session_key=' not in response.url
+
+        export_url = response.url
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(export_url, data={
+                "title": "on",
+                "__format": "csv",
+                "__include_header": "0",
+            })
+        assert response.status_code == 200
+        assert response.content == b'Lucio Dalla\r\n'
+        # the changelist results are not counted
+        self.assertFalse([q for q in queries if 'COUNT(' in q['sql'].upper()])
+
+        response = self.client.get(export_url.replace('status__exact', 'bogus'))
+        assert response.status_code == 400
+
+        # background exports store the filters and rebuild the changelist
+        with tempfile.TemporaryDirectory() as location, self.settings(
+                STORAGES=dict(settings.STORAGES, exports={
+                    'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                    'OPTIONS': {'location': location},
+                }),
+                ADMIN_EXPORT_ACTION={'ASYNC_EXPORT': 'command', 'ASYNC_STORAGE': 'exports'}):
+            self.client.post(export_url, data={
+                "title": "on",
+                "__format": "csv",
+                "__include_header": "0",
+            })
+            job = ExportJob.objects.get()
+            self.assertEqual(job.selection, {'changelist_filters': 'status__exact=2'})
+            call_command('process_export_jobs', stdout=io.StringIO())
+            job.refresh_from_db()
+            with job.file.open('rb') as f:
+                assert f.read() == b'Lucio Dalla\r\n'
+
+    def test_filter_by_pks_should_use_a_single_parameter_above_threshold(self):
+        ids = [str(pk) for pk in News.objects.values_list('pk', flat=True)]
+
+        qs = report.filter_by_pks(News.objects.all(), ids)
+        self.assertEqual(len(qs.query.sql_with_params()[1]), len(ids))
+
+        with self.settings(ADMIN_EXPORT_ACTION={'PK_IN_THRESHOLD': 1}):
+            qs = report.filter_by_pks(News.objects.order_by('-pk'), ids + ['1000'])
+            sql, params = qs.query.sql_with_params()
+            self.assertIn('unnest' if connection.vendor == 'postgresql' else 'json_each', sql)
+            self.assertEqual(len(params), 1)
+            self.assertEqual(list(qs.values_list('pk', flat=True)), [2, 1])
+            self.assertEqual(qs.count(), 2)
+
+    def test_admin_export_post_async_should_run_in_background(self):
+        params = {
+            'ct': ContentType.objects.get_for_model(News).pk,
+            'ids': ','.join(
+                repr(pk) for pk in News.objects.values_list('pk', flat=True))
+        }
+        data = {
+            "id": "on",
+            "title": "on",
+            "__format": "csv",
+            "__include_header": "1",
+        }
+        url = "{}?{}".format(reverse('admin_export_action:export'),
+                             urlencode(params))
+        self.client.login(username='admin', password='admin')
+        storages = dict(settings.STORAGES, exports={
+            'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        })
+        with tempfile.TemporaryDirectory() as location, self.settings(
+                STORAGES=dict(storages, exports=dict(storages['exports'], OPTIONS={'location': location})),
+                ADMIN_EXPORT_ACTION={'ASYNC_EXPORT': 'command', 'ASYNC_STORAGE': 'exports'}):
+            response = self.client.post(url, data=data)
+            job = ExportJob.objects.get()
+            assert response.status_code == 302
+            assert response.url == reverse('admin_export_action:job', args=[job.pk])
+
+            response = self.client.get(response.url)
+            assert response.status_code == 200
+            assert job.get_status_display() in response.content.decode()
+            download_url = reverse('admin_export_action:job_download', args=[job.pk])
+            assert self.client.get(download_url).status_code == 404
+            # ids which are not UUIDs are not found either
+            job_url = reverse('admin_export_action:job', args=[job.pk])
+            assert self.client.get(job_url.replace(str(job.pk), '-' * 36)).status_code == 404
+            assert self.client.get(download_url.replace(str(job.pk), 'abc')).status_code == 404
+
+            call_command('process_export_jobs', stdout=io.StringIO())
+            job.refresh_from_db()
+            assert job.status == ExportJob.STATUS_DONE
+            self.assertEqual(job.file.name, 'export_action/%s.csv' % job.pk)
+            self.assertTrue(os.path.exists(os.path.join(location, job.file.name)))
+
+            response = self.client.get(reverse('admin_export_action:job', args=[job.pk]))
+            assert download_url in response.content.decode()
+            response = self.client.get(download_url)
+            assert response.status_code == 200
+            assert response.getvalue() == (
+                b'ID,main title\r\n1,Lucio Dalla\r\n2,La mano de Dios\r\n')
+            assert response['Content-Disposition'].startswith('attachment; filename="report_')
+            report.close_response(response)
+
+            # stale jobs fail, expired ones are deleted with their file
+            stale = ExportJob.objects.create(
+                user=job.user, content_type=job.content_type, selection=job.selection, fields=job.fields,
+                format='csv', status=ExportJob.STATUS_RUNNING,
+                started_on=datetime.now(timezone.utc) - timedelta(days=1))
+            ExportJob.objects.filter(pk=job.pk).update(finished_on=datetime.now(timezone.utc) - timedelta(days=2))
+            call_command('process_export_jobs', stdout=io.StringIO())
+            self.assertEqual(list(ExportJob.objects.values_list('pk', 'status')),
+                             [(stale.pk, ExportJob.STATUS_FAILED)])
+            self.assertFalse(os.path.exists(os.path.join(location, job.file.name)))
+
+    def test_admin_export_post_should_use_result_cache(self):
+        params = {
+            'ct': ContentType.objects.get_for_model(News).pk,
+            'ids': ','.join(
+                repr(pk) for pk in News.objects.values_list('pk', flat=True))
+        }
+        data = {
+            "title": "on",
+            "category__name": "on",
+            "__format": "csv",
+            "__include_header": "0",
+        }
+        url = "{}?{}".format(reverse('admin_export_action:export'),
+                             urlencode(params))
+        self.client.login(username='admin', password='admin')
+        config = {'RESULT_CACHE': True, 'STREAMING': True}
+        with self.settings(ADMIN_EXPORT_ACTION=config):
+            result_cache.get_cache().clear()
+            response = self.client.post(url, data=data)
+            assert response.streaming
+            content = response.getvalue()
+
+            # served from cache
+            response = self.client.post(url, data=data)
+            assert not response.streaming
+            assert response.content == content
+            assert response['Content-Type'] == 'text/csv; charset=UTF-8'
+
+            response = self.client.post(url, data=dict(data, __include_header="1"))
+            assert response.streaming
+            response.getvalue()
+
+            # changing a model which is not exported keeps the cached exports
+            result_cache.invalidate_model(Tag)
+            response = self.client.post(url, data=data)
+            assert not response.streaming
+
+            # changing a related model invalidates the cached exports
+            result_cache.invalidate_model(Category)
+            response = self.client.post(url, data=data)
+            assert response.streaming
+            response.getvalue()
+
+            # changing a many-to-many relation invalidates the cached exports
+            # through the version of its intermediate model
+            assert 'news.NewsTag' in result_cache.get_export_models(News, ['tags__name'])
+            tags_data = dict(data, tags__name="on")
+            response = self.client.post(url, data=tags_data)
+            response.getvalue()
+            assert not self.client.post(url, data=tags_data).streaming
+            result_cache.connect_signals()
+            self.addCleanup(result_cache.disconnect_signals)
+            News.objects.get(pk=1).tags.add(*Tag.objects.all())
+            response = self.client.post(url, data=tags_data)
+            assert response.streaming
+            response.getvalue()
+
+        with self.settings(ADMIN_EXPORT_ACTION=dict(config, RESULT_CACHE_MAX_SIZE=1)):
+            result_cache.get_cache().clear()
+            for i in range(2):
+                response = self.client.post(url, data=data)
+                assert response.streaming
+                response.getvalue()
+
+    def test_get_model_fields_should_be_cached_sorted_and_immutable(self):
+        model_fields = introspection.get_model_fields(News)
+        self.assertIs(introspection.get_model_fields(News), model_fields)
+        self.assertIsInstance(model_fields.direct, tuple)
+
+        labels = [str(f.label) for f in model_fields.direct]
+        self.assertEqual(labels, sorted(labels))
+        self.assertIn('title', [f.name for f in model_fields.direct])
+
+        relations = {f.field_name: f for f in model_fields.relations}
+        self.assertEqual(set(relations), {'category', 'tags', 'attachments', 'videos', 'newstag'})
+        self.assertEqual(relations['attachments'].label, 'attachments')
+        self.assertEqual(relations['tags'].label, 'all tags')
+        self.assertFalse(hasattr(News._meta.get_field('category'), 'field_name_override'))
+        self.assertIs(relations['category'].field, News._meta.get_field('category'))
+
+        # the former helpers still return Django fields
+        self.assertIn(News._meta.get_field('title'),
+                      introspection.get_direct_fields_from_model(News))
+        relation_fields = introspection.get_relation_fields_from_model(News)
+        self.assertIn(News._meta.get_field('tags'), relation_fields)
+        self.assertEqual(News._meta.get_field('category').field_name_override, 'category')
+
+    def test_admin_export_related_should_not_query_content_types(self):
+        params = {
+            'related': True,
+            'model_ct': ContentType.objects.get_for_model(News).pk,
+            'field': 'category',
+            'path': '',
+        }
+        url = "{}?{}".format(reverse('admin_export_action:export'),
+                             urlencode(params))
+        self.client.login(username='admin', password='admin')
+        self.client.get(url)
+        # only session and user queries once the content types are cached
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        assert response.status_code == 200
+
+    def test_report_to_list_should_check_permissions_once_per_model(self):
+        class CountingUser(object):
+            def __init__(self, denied=()):
+                self.checks = []
+                self.denied = denied
+
+            def has_perm(self, perm):
+                self.checks.append(perm)
+                return perm.split('.')[1].split('_', 1)[1] not in self.denied
+
+        user = CountingUser()
+        data, message = report.report_to_list(
+            News.objects.all(), ['title', 'status', 'category__name', 'category__id'], user)
+        self.assertEqual(len(data), 2)
+        self.assertEqual(message, '')
+        self.assertEqual(sorted(user.checks), [
+            'news.change_category', 'news.change_news',
+            'news.view_category', 'news.view_news',
+        ])
+
+        user = CountingUser(denied=('category', ))
+        data, message = report.report_to_list(
+            News.objects.all(), ['title', 'category__name', 'category__id'], user)
+        self.assertEqual([len(row) for row in data], [1, 1])
+        self.assertEqual(message, 'Error: Permission denied on access to category__name.'
+                                  'Error: Permission denied on access to category__id.')
+        self.assertEqual(len(user.checks), 4)
+
+    def test_report_to_list_aggregate_many_should_export_one_row_per_object(self):
+        admin = User.objects.get(pk=1)
+        fields = ['title', 'tags__name', 'tags__type', 'videos__code', 'category__name']
+        data, messages = report.report_to_list(News.objects.order_by('pk'), fields, admin)
+        # cartesian product of tags and videos
+        self.assertEqual(len(data), 3)
+
+        expected = [
+            ['Lucio Dalla', 'live music', 'generic', '', 'Live'],
+            ['La mano de Dios', 'football, Maradona', 'generic, generic', '1acm_-PDM_0', 'Sport'],
+        ]
+        data, messages = report.report_to_list(News.objects.order_by('pk'), fields, admin,
+                                               aggregate_many=True)
+        self.assertEqual(data, expected)
+
+        rows, messages = report.report_to_iterator(News.objects.order_by('pk'), fields, admin,
+                                                   chunk_size=1, aggregate_many=True)
+        self.assertEqual(list(rows), expected)
+
+        page, data, messages = report.report_to_page(News.objects.all(), fields, admin,
+                                                     page_number=2, per_page=1,
+                                                     aggregate_many=True)
+        self.assertEqual(data, expected[1:])
+
+        with self.settings(ADMIN_EXPORT_ACTION={'TO_MANY_SEPARATOR': None}):
+            data, messages = report.report_to_list(News.objects.order_by('pk'), ['tags__name'],
+                                                   admin, raw_choices=True, aggregate_many=True)
+        self.assertEqual([json.loads(row[0]) for row in data], [['live music'], ['football', 'Maradona']])
+
+    @skipIf(report.pyarrow is None, 'pyarrow is not installed')
+    def test_report_to_arrow_should_write_typed_parquet_and_ipc(self):
+        import pyarrow
+
+        admin = User.objects.get(pk=1)
+        fields = ['id', 'title', 'status', 'share', 'date', 'newstag__created_on']
+        schema, batches, messages = report.report_to_arrow(
+            News.objects.order_by('pk'), fields, admin, chunk_size=1)
+        self.assertEqual(schema.names, fields)
+        self.assertEqual(
+            [str(t) for t in schema.types],
+            ['int64', 'string', 'string', 'bool', 'date32[day]', 'timestamp[us, tz=UTC]'])
+
+        res = report.arrow_to_parquet_response(schema, batches)
+        assert res.status_code == 200
+        assert res['Content-Disposition'].endswith('.parquet"')
+        table = pyarrow.parquet.read_table(io.BytesIO(b''.join(res.streaming_content)))
+        self.assertEqual(table.column('title').to_pylist(),
+                         ['Lucio Dalla', 'La mano de Dios', 'La mano de Dios'])
+        self.assertEqual(table.column('status').to_pylist(), ['published', 'draft', 'draft'])
+
+        schema, batches, messages = report.report_to_arrow(
+            News.objects.order_by('pk'), ['status', 'tags__name'], admin,
+            raw_choices=True, aggregate_many=True, verbose_names=True)
+        self.assertEqual(schema.names, ['status', 'all tags verbose name'])
+        res = report.arrow_to_ipc_response(schema, batches)
+        table = pyarrow.ipc.open_file(io.BytesIO(b''.join(res.streaming_content))).read_all()
+        self.assertEqual(table.column('status').to_pylist(), [2, 1])
+        self.assertEqual(table.column('all tags verbose name').to_pylist(),
+                         ['live music', 'football, Maradona'])
+
+    def test_admin_export_post_should_compress_while_streaming(self):
+        params = {
+            'ct': ContentType.objects.get_for_model(News).pk,
+            'ids': ','.join(
+                repr(pk) for pk in News.objects.values_list('pk', flat=True))
+        }
+        data = {
+            "title": "on",
+            "__format": "csv",
+            "__include_header": "1",
+            "__compress": "gzip",
+        }
+        url = "{}?{}".format(reverse('admin_export_action:export'),
+                             urlencode(params))
+        self.client.login(username='admin', password='admin')
+
+        response = self.client.post(url, data=data, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        assert response.streaming
+        assert response['Content-Encoding'] == 'gzip'
+        assert response['Content-Disposition'] == 'attachment; filename="report.csv"'
+        content = gzip.decompress(response.getvalue()).decode('utf-8')
+        assert 'Lucio Dalla' in content
+
+        response = self.client.post(url, data=data)
+        assert not response.has_header('Content-Encoding')
+        assert response['Content-Type'] == 'application/gzip'
+        assert response['Content-Disposition'] == 'attachment; filename="report.csv.gz"'
+        self.assertEqual(gzip.decompress(response.getvalue()).decode('utf-8'), content)
+
+        data['__compress'] = 'zip'
+        response = self.client.post(url, data=data)
+        assert response['Content-Disposition'] == 'attachment; filename="report.zip"'
+        with zipfile.ZipFile(io.BytesIO(response.getvalue())) as archive:
+            self.assertEqual(archive.namelist(), ['report.csv'])
+            self.assertEqual(archive.read('report.csv').decode('utf-8'), content)
+
+        chunks = list(report.iter_gzip(iter([b'a' * 10, b'b' * 10])))
+        self.assertEqual(gzip.decompress(b''.join(chunks)), b'a' * 10 + b'b' * 10)
+
+    def test_admin_export_post_sheets_should_export_relations_on_their_own_sheet(self):
+        params = {
+            'ct': ContentType.objects.get_for_model(News).pk,
+            'ids': ','.join(
+                repr(pk) for pk in News.objects.values_list('pk', flat=True))
+        }
+        data = {
+            "title": "on",
+            "tags__name": "on",
+            "__format": "sheets",
+            "__include_header": "1",
+        }
+        url = "{}?{}".format(reverse('admin_export_action:export'),
+                             urlencode(params))
+        self.client.login(username='admin', password='admin')
+        # SQLite test transactions are not visible to other threads
+        with self.settings(ADMIN_EXPORT_ACTION={'SHEET_WORKERS': 1}):
+            response = self.client.post(url, data=data)
+        assert response.status_code == 200
+        wb = load_workbook(io.BytesIO(response.getvalue()))
+        self.assertEqual(wb.sheetnames, ['report', 'tags'])
+        self.assertEqual([[c.value for c in r] for r in wb['report'].iter_rows()], [
+            ['ID', 'main title'], [1, 'Lucio Dalla'], [2, 'La mano de Dios'],
+        ])
+        self.assertEqual([[c.value for c in r] for r in wb['tags'].iter_rows()], [
+            ['news ID', 'all tags verbose name'], [1, 'live music'], [2, 'football'], [2, 'Maradona'],
+        ])
+
+    def test_export_benchmark_command_should_write_json_results(self):
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command('export_benchmark', rows=[5], output=output.name, current_database=True,
+                         only=['report_to_list', 'list_to_csv_response'], stderr=io.StringIO())
+            results = json.load(output)
+        self.assertEqual(News.objects.count(), 5)
+        self.assertEqual(NewsTag.objects.filter(news__pk__gt=2).count(), 6)
+        self.assertEqual([(r['name'], r['rows'], r['queries']) for r in results['results']], [
+            ('report_to_list', 5, 1), ('list_to_csv_response', 5, 0),
+        ])
+        assert all(r['wall_time'] > 0 and r['peak_memory'] > 0 for r in results['results'])
+
+    def test_admin_export_post_should_report_phase_timings(self):
+        params = {
+            'ct': ContentType.objects.get_for_model(News).pk,
+            'ids': ','.join(
+                repr(pk) for pk in News.objects.values_list('pk', flat=True))
+        }
+        data = {
+            "title": "on",
+            "tags__name": "on",
+            "__format": "xlsx",
+            "__include_header": "1",
+        }
+        url = "{}?{}".format(reverse('admin_export_action:export'),
+                             urlencode(params))
+        self.client.login(username='admin', password='admin')
+        received = []
+
+        def receiver(sender, timings, **kwargs):
+            received.append((sender, timings))
+
+        export_finished.connect(receiver)
+        try:
+            with self.assertLogs('admin_export_action.instrumentation', 'INFO') as logs:
+                response = self.client.post(url, data=data)
+                content = response.getvalue()
+            self.assertEqual(len(received), 1)
+            sender, timings = received[0]
+            self.assertEqual(sender, News)
+            self.assertEqual((timings.format, timings.rows, timings.columns, timings.bytes),
+                             ('xlsx', 3, 2, len(content)))
+            assert all(timings.durations[name] > 0 for name in ('sql', 'convert', 'write', 'save'))
+            assert response['Server-Timing'].startswith('sql;dur=')
+            assert 'save;dur=' in response['Server-Timing']
+            self.assertEqual(logs.records[0].export_timings['rows'], 3)
+
+            # streamed content is timed while it is sent
+            data['__format'] = 'csv'
+            with self.settings(ADMIN_EXPORT_ACTION={'STREAMING': True}):
+                response = self.client.post(url, data=data)
+            self.assertEqual(len(received), 1)
+            content = response.getvalue()
+            self.assertEqual(len(received), 2)
+            timings = received[1][1]
+            self.assertEqual((timings.rows, timings.bytes), (3, len(content)))
+        finally:
+            export_finished.disconnect(receiver)
+
+    @skipIf(report.xlsxwriter is None, 'XlsxWriter is not installed')
+    def test_xlsxwriter_backend_should_write_the_same_cells(self):
+        admin = User.objects.get(pk=1)
+        fields = ['id', 'title', 'status', 'date', 'datetime', 'share', 'link', 'newstag__created_on']
+        queryset = News.objects.order_by('pk', 'newstag__pk')
+        header = [report.get_field_verbose_name(queryset, field) for field in fields]
+        data, message = report.report_to_list(queryset, fields, admin)
+        data[0][1] = '=1+1'  # strings are never written as formulas
+
+        def cells(response):
+            ws = load_workbook(io.BytesIO(response.getvalue())).worksheets[0]
+            return [[cell.value for cell in row] for row in ws.iter_rows()]
+
+        expected = cells(report.list_to_xlsx_response(data, header=header))
+        with self.settings(ADMIN_EXPORT_ACTION={'XLSX_BACKEND': 'xlsxwriter'}):
+            expected[1][1] = '=1+1'
+            response = report.list_to_xlsx_response(data, header=header, widths=[10] * len(fields))
+            ws = load_workbook(io.BytesIO(response.getvalue())).worksheets[0]
+            self.assertEqual([[cell.value for cell in row] for row in ws.iter_rows()], expected)
+            assert ws['A1'].font.b and not ws['A2'].font.b
+            self.assertEqual(ws['D2'].number_format, 'yyyy-mm-dd')
+            self.assertAlmostEqual(ws.column_dimensions['A'].width, 10, delta=1)  # XlsxWriter adds a padding
+
+            response = report.iter_to_xlsx_response(iter(data), header=header)
+            self.assertEqual(cells(response), expected)
+
+            response = report.list_to_xlsx_response({'a': [[1]], 'b': [['x']]}, header={'a': ['A'], 'b': ['B']})
+            wb = load_workbook(io.BytesIO(response.getvalue()))
+            self.assertEqual([[[c.value for c in row] for row in ws.iter_rows()] for ws in wb], [
+                [['A'], [1]], [['B'], ['x']],
+            ])
+
+    def test_xlsx_writers_should_split_sheets_past_max_rows(self):
+        data = [[i, 'row %d' % i] for i in range(1, 6)]
+
+        def sheets(response):
+            wb = load_workbook(io.BytesIO(response.getvalue()))
+            return [(ws.title, [[c.value for c in row] for row in ws.iter_rows()]) for ws in wb]
+
+        expected = [
+            ('report', [['id', 'title'], [1, 'row 1'], [2, 'row 2']]),
+            ('report_2', [['id', 'title'], [3, 'row 3'], [4, 'row 4']]),
+            ('report_3', [['id', 'title'], [5, 'row 5']]),
+        ]
+        backends = ['openpyxl'] + (['xlsxwriter'] if report.xlsxwriter is not None else [])
+        for backend in backends:
+            with self.settings(ADMIN_EXPORT_ACTION={'XLSX_MAX_ROWS': 3, 'XLSX_BACKEND': backend}):
+                response = report.list_to_xlsx_response([list(row) for row in data], header=['id', 'title'])
+                self.assertEqual(sheets(response), expected)
+                response = report.iter_to_xlsx_response(iter(data), header=['id', 'title'])
+                self.assertEqual(sheets(response), expected)
+                # no empty worksheet when the rows fill the last one exactly
+                response = report.iter_to_xlsx_response(iter(data[:4]))
+                self.assertEqual(sheets(response), [('report', data[:3]), ('report_2', data[3:4])])
+                response = report.list_to_xlsx_response(
+                    {'report': [list(row) for row in data[:2]], 'tags': [[1, 'a'], [1, 'b'], [2, 'c']]},
+                    header={'report': ['id', 'title'], 'tags': ['news ID', 'tag']})
+                self.assertEqual(sheets(response), [
+                    ('report', [['id', 'title'], [1, 'row 1'], [2, 'row 2']]),
+                    ('tags', [['news ID', 'tag'], [1, 'a'], [1, 'b']]),
+                    ('tags_2', [['news ID', 'tag'], [2, 'c']]),
+                ])
+
+    def test_admin_export_post_should_limit_concurrent_exports(self):
+        params = {
+            'ct': ContentType.objects.get_for_model(News).pk,
+            'ids': ','.join(
+                repr(pk) for pk in News.objects.values_list('pk', flat=True))
+        }
+        data = {"id": "on", "title": "on", "__format": "csv"}
+        url = "{}?{}".format(reverse('admin_export_action:export'),
+                             urlencode(params))
+        self.client.login(username='admin', password='admin')
+        with self.settings(ADMIN_EXPORT_ACTION={'STREAMING': True, 'ADMISSION_MAX_USER_EXPORTS': 1,
+                                                'ADMISSION_RETRY_AFTER': 10}):
+            streaming = self.client.post(url, data=data)
+            rejected = self.client.post(url, data=data)
+            self.assertEqual(rejected.status_code, 429)
+            self.assertEqual(rejected['Retry-After'], '10')
+
+            # the slot is released once the stream has been sent
+            b''.join(streaming.streaming_content)
+            response = self.client.post(url, data=data)
+            self.assertEqual(response.status_code, 200)
+
+            # or once the response is closed, even if it was never sent
+            report.close_response(response)
+            response = self.client.post(url, data=data)
+            self.assertEqual(response.status_code, 200)
+            b''.join(response.streaming_content)
+
+        admin = User.objects.get(pk=1)
+        with self.settings(ADMIN_EXPORT_ACTION={'ADMISSION_SLOW_LANE_ROWS': 1}):
+            slow = admission.acquire(admin, News.objects.all())
+            self.assertIsNone(admission.acquire(admin, News.objects.all()))
+            fast = admission.acquire(admin, News.objects.filter(pk=1))
+            self.assertIsNotNone(fast)
+            slow.release()
+            slow.release()
+            fast.release()
+            admission.acquire(admin, News.objects.all()).release()
+
+    def test_admin_export_post_csv_should_use_postgres_copy(self):
+        params = {
+            'ct': ContentType.objects.get_for_model(News).pk,
+            'ids': ','.join(
+                repr(pk) for pk in News.objects.values_list('pk', flat=True))
+        }
+        data = {
+            "id": "on",
+            "title": "on",
+            "status": "on",
+            "share": "on",
+            "category__name": "on",
+            "__format": "csv",
+            "__include_header": "1",
+            "__raw_choices": "1",
+        }
+        url = "{}?{}".format(reverse('admin_export_action:export'),
+                             urlencode(params))
+        self.client.login(username='admin', password='admin')
+        received = []
+
+        def receiver(sender, timings, **kwargs):
+            received.append(timings)
+
+        export_finished.connect(receiver)
+        try:
+            with self.settings(ADMIN_EXPORT_ACTION={'POSTGRES_COPY': True}):
+                response = self.client.post(url, data=data)
+                content = response.getvalue().decode('utf-8')
+        finally:
+            export_finished.disconnect(receiver)
+        self.assertEqual(received[0].rows, 2)
+
+        if connection.vendor != 'postgresql':
+            # other backends fall back to the csv writer
+            self.assertEqual(content, self.client.post(url, data=data).getvalue().decode('utf-8'))
+            return
+
+        self.assertEqual(content, 'ID,main title,status,share,category name\n'
+                                  '1,Lucio Dalla,2,t,Live\n'
+                                  '2,La mano de Dios,1,f,Sport\n')
+        # display values are still converted in Python
+        data['__raw_choices'] = '0'
+        with self.settings(ADMIN_EXPORT_ACTION={'POSTGRES_COPY': True}):
+            response = self.client.post(url, data=data)
+        assert b'published' in response.getvalue()
+
+
+class SheetWorkersTest(TransactionTestCase):
+    """ Sheet worker threads use connections of their own, they can only
+    see committed data """
+    fixtures = ["tests.json"]
+    reset_sequences = True
+
+    def test_report_to_sheets_should_build_sheets_concurrently(self):
+        admin = User.objects.get(pk=1)
+        fields = ['title', 'tags__name', 'videos__code']
+        with self.settings(ADMIN_EXPORT_ACTION={'SHEET_WORKERS': 1}):
+            expected = report.report_to_sheets(News.objects.order_by('pk'), fields, admin)
+
+        threads = []
+        build_sheet_rows = report._build_sheet_rows
+
+        def record_thread(*args):
+            threads.append(threading.current_thread().name)
+            return build_sheet_rows(*args)
+
+        with mock.patch.object(report, '_build_sheet_rows', record_thread):
+            sheets, headers, message = report.report_to_sheets(News.objects.order_by('pk'), fields, admin)
+        self.assertEqual(get_config('SHEET_WORKERS'), 4)
+        self.assertEqual(len(threads), 3)
+        self.assertTrue(all(name.startswith('admin_export_action') for name in threads))
+        self.assertEqual((sheets, headers, message), expected)
+        self.assertEqual(list(sheets), ['report', 'tags', 'videos'])
+        self.assertEqual(sheets['tags'], [[1, 'live music'], [2, 'football'], [2, 'Maradona']])
@@ -0,0 +1,242 @@
+# coding: utf-8
+"""Benchmark of the export pipeline.
+
+Populates a throwaway test database with News and their Tag, NewsTag,
+Attachment and Video objects, then measures wall time, peak memory
+(tracemalloc) and query count of the report and writer functions for
+every requested size. Results are written as JSON, so that runs of
+different releases can be compared.
+"""
+import gc
+import json
+import platform
+import random
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta, timezone
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from openpyxl.workbook import Workbook
+
+import admin_export_action
+from admin_export_action import report
+from news.models import Attachment, Category, News, NewsTag, Tag, Video
+
+BATCH_SIZE = 10000
+FIELDS = [
+    'id', 'title', 'status', 'date', 'datetime', 'share', 'link',
+    'category__name', 'content',
+]
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+         'eiusmod tempor incididunt ut labore et dolore magna aliqua').split()
+
+
+def _text(rnd, words):
+    return ' '.join(rnd.choice(WORDS) for i in range(words))
+
+
+def populate(rows, seed=0):
+    """Add News (and their related objects) until there are `rows` of
+    them: every news has 2 tags, 1 attachment and 1 video"""
+    rnd = random.Random(seed + News.objects.count())
+    categories = list(Category.objects.all()) or Category.objects.bulk_create(
+        [Category(name='category %d' % i) for i in range(10)])
+    tags = list(Tag.objects.all()) or Tag.objects.bulk_create([
+        Tag(name='tag %d' % i, type=rnd.choice((Tag.TYPE_GENERIC, Tag.TYPE_SPECIFIC)))
+        for i in range(50)
+    ])
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+    while True:
+        missing = rows - News.objects.count()
+        if missing <= 0:
+            break
+        news = News.objects.bulk_create([
+            News(category=rnd.choice(categories),
+                 date=date(2020, 1, 1) + timedelta(days=rnd.randrange(1000)),
+                 datetime=start + timedelta(seconds=rnd.randrange(10 ** 8)),
+                 title=_text(rnd, 5)[:50],
+                 link='https://example.com/%d' % rnd.randrange(10 ** 6),
+                 content=_text(rnd, 80),
+                 share=rnd.random() < 0.5,
+                 status=rnd.choice((News.ARCHIVED, News.DRAFT, News.PUBLISHED)))
+            for i in range(min(missing, BATCH_SIZE))
+        ])
+        NewsTag.objects.bulk_create([
+            NewsTag(news=item, tag=tag)
+            for item in news for tag in rnd.sample(tags, 2)
+        ])
+        Attachment.objects.bulk_create([
+            Attachment(news=item, file='news/img/%d.pdf' % item.pk,
+                       caption=_text(rnd, 10))
+            for item in news
+        ])
+        Video.objects.bulk_create([
+            Video(news=item, code='v%d' % item.pk, caption=_text(rnd, 10),
+                  author_email='author%d@example.com' % rnd.randrange(100))
+            for item in news
+        ])
+
+
+def _consume(response):
+    """Read the whole response, as the client would"""
+    size = sum(len(chunk) for chunk in response)
+    report.close_response(response)
+    return size
+
+
+def get_benchmarks(user, fields):
+    """Return a list of (name, function) to benchmark"""
+    queryset = News.objects.order_by('pk')
+    header = [report.get_field_verbose_name(queryset, field) for field in fields]
+
+    def data():
+        return report.report_to_list(queryset, fields, user)[0]
+
+    def build_sheet(data):
+        report.build_sheet(data, Workbook().worksheets[0], header=header)
+
+    def iter_rows():
+        return report.report_to_iterator(queryset, fields, user)[0]
+
+    # writers of a ready list are measured on their own, the list is built
+    # out of the measure
+    benchmarks = [
+        ('report_to_list', None, data),
+        ('build_sheet', data, build_sheet),
+        ('list_to_xlsx_response', data,
+         lambda data: _consume(report.list_to_xlsx_response(data, header=header))),
+        ('list_to_csv_response', data,
+         lambda data: _consume(report.list_to_csv_response(data, header=header))),
+        ('list_to_json_response', data,
+         lambda data: _consume(report.list_to_json_response(data, header=header))),
+        ('list_to_html_response', data,
+         lambda data: _consume(report.list_to_html_response(data, header=header))),
+        ('report_to_list aggregate_many', None,
+         lambda: report.report_to_list(
+             queryset, fields + ['tags__name', 'attachments__caption'], user,
+             aggregate_many=True)),
+        ('iter_to_xlsx_response', iter_rows,
+         lambda rows: _consume(report.iter_to_xlsx_response(rows, header=header))),
+        ('iter_to_csv_response', iter_rows,
+         lambda rows: _consume(report.iter_to_csv_response(rows, header=header))),
+        ('iter_to_json_response', iter_rows,
+         lambda rows: _consume(report.iter_to_json_response(rows, header=header))),
+    ]
+    return benchmarks
+
+
+def measure(setup, func, memory=True):
+    """Return wall time, peak memory and query count of func(setup())"""
+    args = [setup()] if setup is not None else []
+    gc.collect()
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        func(*args)
+        wall_time = time.perf_counter() - started
+
+    peak = None
+    if memory:
+        # tracemalloc slows everything down, memory is measured on a
+        # second run
+        args = [setup()] if setup is not None else []
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return wall_time, peak, len(queries)
+
+
+class Command(BaseCommand):
+    help = "Benchmark the export pipeline, writing the results as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            nargs='+',
+            default=[10000, 100000, 1000000],
+            help='Numbers of news to export',
+        )
+        parser.add_argument(
+            '--output',
+            default='export_benchmark.json',
+            help='File the JSON results are written to, - for stdout',
+        )
+        parser.add_argument(
+            '--only',
+            nargs='+',
+            help='Run only the named benchmarks',
+        )
+        parser.add_argument(
+            '--no-memory',
+            action='store_true',
+            help='Do not measure peak memory, which needs a second run',
+        )
+        parser.add_argument(
+            '--current-database',
+            action='store_true',
+            help='Populate the configured database instead of a test database',
+        )
+
+    def handle(self, *args, **options):
+        old_name = None
+        if not options['current_database']:
+            old_name = connection.creation.create_test_db(verbosity=0,
+                                                          autoclobber=True)
+        try:
+            results = self.run(options)
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        output = json.dumps({
+            'version': admin_export_action.__version__,
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'date': datetime.now(timezone.utc).isoformat(),
+            'results': results,
+        }, indent=2)
+        if options['output'] == '-':
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            self.stderr.write('Results written to %s' % options['output'])
+
+    def run(self, options):
+        user = User.objects.filter(is_superuser=True).first() or \
+            User.objects.create_superuser('benchmark', 'benchmark@example.com',
+                                          'benchmark')
+        results = []
+        for rows in sorted(options['rows']):
+            started = time.perf_counter()
+            populate(rows)
+            self.stderr.write('%d news populated in %.1fs' % (
+                rows, time.perf_counter() - started))
+
+            for name, setup, func in get_benchmarks(user, FIELDS):
+                if options['only'] and name not in options['only']:
+                    continue
+                wall_time, peak, queries = measure(
+                    setup, func, memory=not options['no_memory'])
+                results.append({
+                    'name': name,
+                    'rows': rows,
+                    'wall_time': wall_time,
+                    'peak_memory': peak,
+                    'queries': queries,
+                })
+                self.stderr.write('%s %d rows: %.3fs %s %d queries' % (
+                    name, rows, wall_time,
+                    '-' if peak is None else '%.1fMB' % (peak / 2 ** 20),
+                    queries))
+        return results